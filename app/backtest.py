@@ -0,0 +1,207 @@
+import os
+import re
+import json
+import time
+import asyncio
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from . import fastpath
+
+#Бэктест кандидата в триггеры по накопленной истории: тексты читаются потоком (курсор БД или
+#локальный корпус), режутся на пачки и матчатся в пуле процессов на всех ядрах.
+#Учтите: в logs лежат только сообщения, уже совпавшие с какими-то триггерами, поэтому
+#для честной оценки шума лучше корпус всех сообщений (NDJSON из /export/logs или текст построчно).
+
+BACKTEST_WORKERS = int(os.getenv("BACKTEST_WORKERS", str(os.cpu_count() or 2)))
+BACKTEST_CHUNK = int(os.getenv("BACKTEST_CHUNK", "5000"))
+BACKTEST_CORPUS_DIR = os.getenv("BACKTEST_CORPUS_DIR", "corpus")
+#сколько ждём хоть одну пачку, сек: дольше — регулярка патологическая, пул пересоздаётся
+BACKTEST_CHUNK_TIMEOUT = float(os.getenv("BACKTEST_CHUNK_TIMEOUT", "60"))
+MAX_SAMPLES = 10
+
+_executor: Optional[ProcessPoolExecutor] = None
+#кэш скомпилированных регулярок внутри процесса-воркера
+_compiled: Dict[Tuple[str, int], Any] = {}
+
+
+def trigger_flags(flags: int) -> int:
+    #Те же флаги, что и у боевых триггеров (см. tele_client.refresh_triggers_cache)
+    return (int(flags or 0) & ~re.LOCALE) | re.IGNORECASE
+
+
+def _run_chunk(pattern: str, flags: int, texts: List[str]) -> Dict[str, Any]:
+    #Выполняется в процессе пула: матчинг одной пачки
+    key = (pattern, flags)
+    creg = _compiled.get(key)
+    if creg is None:
+        creg = _compiled[key] = re.compile(pattern, flags)
+    started = time.process_time()
+    hit_messages = 0
+    matches = 0
+    samples = []
+    for text in texts:
+        first = None
+        n = 0
+        for m in creg.finditer(text):
+            if first is None:
+                first = m
+            n += 1
+        if first is None:
+            continue
+        hit_messages += 1
+        matches += n
+        if len(samples) < MAX_SAMPLES:
+            samples.append({"matched_text": first.group(0), "text": text[:300]})
+    return {
+        "messages": len(texts),
+        "hit_messages": hit_messages,
+        "matches": matches,
+        "samples": samples,
+        "cpu_seconds": time.process_time() - started,
+    }
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        #spawn, а не fork: в процессе работают потоки (uvicorn, Telethon), и дочерний процесс
+        #после fork может навсегда повиснуть на чужой блокировке
+        _executor = ProcessPoolExecutor(max_workers=BACKTEST_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def shutdown(kill: bool = False):
+    #kill — завершить и занятые воркеры (зависшая на регулярке пачка иначе держит процесс)
+    global _executor
+    if _executor is not None:
+        processes = list((getattr(_executor, "_processes", None) or {}).values()) if kill else []
+        _executor.shutdown(wait=False, cancel_futures=True)
+        for p in processes:
+            p.terminate()
+        _executor = None
+
+
+class ChunkTimeout(Exception):
+    pass
+
+
+async def _collect(pending: set, results: List[Dict[str, Any]], keep: int = 0):
+    #Забирает готовые пачки, пока в работе больше keep; ни одна не закончилась за
+    #BACKTEST_CHUNK_TIMEOUT — значит, каждая занятая пачка идёт дольше: убиваем пул
+    while len(pending) > keep:
+        done, _ = await asyncio.wait(pending, timeout=BACKTEST_CHUNK_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            for f in pending:
+                f.cancel()
+            pending.clear()
+            shutdown(kill=True)
+            raise ChunkTimeout(f"pattern too slow: no chunk of {BACKTEST_CHUNK} messages finished in {BACKTEST_CHUNK_TIMEOUT}s")
+        for d in done:
+            pending.discard(d)
+            results.append(d.result())
+
+
+def corpus_path(name: str) -> str:
+    #Путь к корпусу только внутри BACKTEST_CORPUS_DIR
+    base = os.path.realpath(BACKTEST_CORPUS_DIR)
+    path = os.path.realpath(os.path.join(base, name))
+    if os.path.commonpath([base, path]) != base or not os.path.isfile(path):
+        raise ValueError(f"corpus not found in {BACKTEST_CORPUS_DIR}: {name}")
+    return path
+
+
+async def _iter_corpus(path: str) -> AsyncIterator[Tuple[str, Optional[float]]]:
+    #Строка — сообщение; строки-JSON (NDJSON из /export/logs) читаются как {"text", "created_at"}
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f):
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            text, ts = line, None
+            if line.startswith("{"):
+                try:
+                    obj = json.loads(line)
+                    text = obj.get("text") or ""
+                    if obj.get("created_at"):
+                        ts = datetime.fromisoformat(obj["created_at"]).timestamp()
+                except ValueError:
+                    pass
+            yield text, ts
+            if n % 10000 == 0:
+                #отдаём управление event loop на больших файлах
+                await asyncio.sleep(0)
+
+
+async def _iter_logs(days: Optional[int]) -> AsyncIterator[Tuple[str, Optional[float]]]:
+    async for r in fastpath.iter_backtest_texts(days):
+        yield r["text"], r["created_at"].timestamp() if r["created_at"] else None
+
+
+async def run(pattern: str, flags: int = 0, source: str = "logs", days: Optional[int] = 30,
+              corpus: Optional[str] = None, max_messages: Optional[int] = None) -> Dict[str, Any]:
+    flags = trigger_flags(flags)
+    re.compile(pattern, flags)  # ошибка в регулярке — до запуска пула
+
+    if source == "corpus":
+        rows = _iter_corpus(corpus_path(corpus or ""))
+    else:
+        rows = _iter_logs(days)
+
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    started = time.perf_counter()
+    pending = set()
+    results = []
+    texts: List[str] = []
+    first_ts = last_ts = None
+    total = 0
+
+    def submit():
+        pending.add(loop.run_in_executor(executor, _run_chunk, pattern, flags, texts[:]))
+        texts.clear()
+
+    try:
+        async for text, ts in rows:
+            texts.append(text or "")
+            if ts is not None:
+                first_ts = ts if first_ts is None else min(first_ts, ts)
+                last_ts = ts if last_ts is None else max(last_ts, ts)
+            total += 1
+            if len(texts) >= BACKTEST_CHUNK:
+                submit()
+                #не держим в памяти больше двух пачек на воркер
+                await _collect(pending, results, keep=BACKTEST_WORKERS * 2 - 1)
+            if max_messages and total >= max_messages:
+                break
+    finally:
+        #закрываем генератор сразу: он держит соединение пула и транзакцию курсора
+        await rows.aclose()
+    if texts:
+        submit()
+    await _collect(pending, results)
+
+    messages = sum(r["messages"] for r in results)
+    hit_messages = sum(r["hit_messages"] for r in results)
+    cpu = sum(r["cpu_seconds"] for r in results)
+    samples = [s for r in results for s in r["samples"]][:MAX_SAMPLES]
+    span_days = None
+    if first_ts is not None and last_ts is not None:
+        span_days = max((last_ts - first_ts) / 86400, 1 / 24)
+    elif days:
+        span_days = float(days)
+    return {
+        "pattern": pattern,
+        "source": source,
+        "messages": messages,
+        "hit_messages": hit_messages,
+        "matches": sum(r["matches"] for r in results),
+        "hit_ratio": round(hit_messages / messages, 6) if messages else 0.0,
+        "span_days": round(span_days, 3) if span_days else None,
+        "est_hits_per_day": round(hit_messages / span_days, 2) if span_days else None,
+        "cost_us_per_message": round(cpu / messages * 1e6, 3) if messages else None,
+        "wall_seconds": round(time.perf_counter() - started, 3),
+        "workers": BACKTEST_WORKERS,
+        "samples": samples,
+    }
@@ -1,6 +1,7 @@
 from sqlalchemy import text
 from .models import Trigger, Target, Log  # только для типов возвращаемых объектов
 from .db import AsyncSessionLocal
+from . import versions
 from typing import List, Optional
 
 #Создать нового триггера в базе
@@ -51,6 +52,8 @@ async def delete_trigger(tid: int):
         sql = text("DELETE FROM triggers WHERE id = :tid")
         await db.execute(sql, {"tid": tid})
         await db.commit()
+        #логи триггера удаляются каскадом — ETag лент должен смениться
+        versions.bump("logs")
         return True
 
 
@@ -65,6 +68,7 @@ async def create_target(data) -> Target:
         res = await db.execute(sql, data)
         row = res.first()
         await db.commit()
+        versions.bump("targets")
         return row
 
 #Список таргетов
@@ -98,6 +102,7 @@ async def upsert_target_by_tgid(tgid: int, username: str = None, title: str = No
             })
             row = res2.first()
             await db.commit()
+            versions.bump("targets")
             return row
         else:
             sql = text("""
@@ -113,6 +118,7 @@ async def upsert_target_by_tgid(tgid: int, username: str = None, title: str = No
             })
             row = res2.first()
             await db.commit()
+            versions.bump("targets")
             return row
 
 #Получить target по внутреннему id
@@ -140,6 +146,7 @@ async def create_log(data) -> Log:
         res = await db.execute(sql, data)
         row = res.first()
         await db.commit()
+        versions.bump("logs")
         return row
 
 #Получить список логов
@@ -151,3 +158,42 @@ async def list_logs(limit: int = 50, offset: int = 0):
         """)
         res = await db.execute(sql, {"limit": limit, "offset": offset})
         return res.fetchall()
+
+
+#Создать или заменить подписку чата с фильтрами
+async def upsert_subscription(chat_id: int, data: dict):
+    async with AsyncSessionLocal() as db:
+        sql = text("""
+            INSERT INTO subscriptions (chat_id, trigger_ids, target_ids, author_ids)
+            VALUES (:chat_id, :trigger_ids, :target_ids, :author_ids)
+            ON CONFLICT (chat_id) DO UPDATE
+            SET trigger_ids = EXCLUDED.trigger_ids,
+                target_ids = EXCLUDED.target_ids,
+                author_ids = EXCLUDED.author_ids
+            RETURNING *
+        """)
+        res = await db.execute(sql, {"chat_id": chat_id, **data})
+        row = res.first()
+        await db.commit()
+        versions.bump("subscriptions")
+        return row
+
+#Список подписок
+async def list_subscriptions():
+    async with AsyncSessionLocal() as db:
+        res = await db.execute(text("SELECT * FROM subscriptions ORDER BY id"))
+        return res.fetchall()
+
+#Получить подписку по chat_id
+async def get_subscription(chat_id: int):
+    async with AsyncSessionLocal() as db:
+        res = await db.execute(text("SELECT * FROM subscriptions WHERE chat_id = :chat_id"), {"chat_id": chat_id})
+        return res.first()
+
+#Удалить подписку по chat_id
+async def delete_subscription(chat_id: int):
+    async with AsyncSessionLocal() as db:
+        await db.execute(text("DELETE FROM subscriptions WHERE chat_id = :chat_id"), {"chat_id": chat_id})
+        await db.commit()
+        versions.bump("subscriptions")
+        return True
@@ -1,4 +1,5 @@
 import os
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
@@ -14,7 +15,41 @@ AsyncSessionLocal = sessionmaker(bind=engine, class_=AsyncSession, expire_on_com
 
 Base = declarative_base()
 
-async def init_models():
-    # создаст таблицы при старте FastAPI
+#create_all не трогает уже существующие таблицы, поэтому новые индексы/колонки
+#для старых баз досоздаём идемпотентными запросами
+MIGRATIONS = [
+    "CREATE INDEX IF NOT EXISTS logs_trigger_id_idx ON logs (matched_trigger_id, id)",
+    "CREATE INDEX IF NOT EXISTS logs_target_id_idx ON logs (target_id, id)",
+    "CREATE INDEX IF NOT EXISTS logs_author_id_idx ON logs (author_id, id)",
+    "ALTER TABLE logs ADD COLUMN IF NOT EXISTS text_hash VARCHAR(32)",
+    "ALTER TABLE logs ADD COLUMN IF NOT EXISTS duplicate BOOLEAN DEFAULT FALSE",
+    "CREATE INDEX IF NOT EXISTS ix_logs_text_hash ON logs (text_hash)",
+]
+
+#Версия схемы: увеличивайте при изменении моделей или MIGRATIONS.
+#Если в schema_meta записана та же версия, create_all и миграции на старте пропускаются
+SCHEMA_VERSION = 1
+
+async def schema_version():
+    #Записанная в БД версия схемы или None (свежая база / до появления schema_meta)
+    async with engine.connect() as conn:
+        exists = (await conn.execute(text("SELECT to_regclass('schema_meta') IS NOT NULL"))).scalar()
+        if not exists:
+            return None
+        return (await conn.execute(text("SELECT version FROM schema_meta WHERE id = 1"))).scalar()
+
+
+async def init_models() -> bool:
+    # создаст таблицы при старте FastAPI; False — схема уже актуальна, ничего не делали
+    if await schema_version() == SCHEMA_VERSION:
+        return False
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
+        for sql in MIGRATIONS:
+            await conn.execute(text(sql))
+        await conn.execute(text("CREATE TABLE IF NOT EXISTS schema_meta (id INT PRIMARY KEY, version INT NOT NULL)"))
+        await conn.execute(
+            text("INSERT INTO schema_meta (id, version) VALUES (1, :v) ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version"),
+            {"v": SCHEMA_VERSION}
+        )
+    return True
@@ -0,0 +1,208 @@
+import os
+import time
+import asyncio
+from typing import Any, Dict, List, Optional
+from . import fastpath
+
+#Встроенный репостер (EMBEDDED_REPOSTER=true): диспетчер aiogram и доставка работают в процессе
+#сканера. Совпадения идут из tele_client._process_message в доставку через очередь в памяти,
+#параллельно с записью в БД, — без опроса /feed, HTTP и разбора JSON. Один процесс вместо трёх.
+#Фильтры подписок проверяются локально (fastpath.get_subscription_filters, кэш по версии подписок).
+#При остановке очередь досылается (до EMBEDDED_DRAIN_TIMEOUT), курсор файла состояния сдвигается
+#только до последнего доставленного лога. При падении процесса очередь теряется (логи в БД остаются).
+
+EMBEDDED_REPOSTER = os.getenv("EMBEDDED_REPOSTER", "false").lower() in ("1", "true", "yes")
+EMBEDDED_QUEUE_SIZE = int(os.getenv("EMBEDDED_QUEUE_SIZE", "10000"))
+#сколько при остановке ждём отправки того, что уже в очереди, сек
+EMBEDDED_DRAIN_TIMEOUT = float(os.getenv("EMBEDDED_DRAIN_TIMEOUT", "30"))
+
+_queue: Optional[asyncio.Queue] = None
+_tasks: List[asyncio.Task] = []
+_bot = None
+_dp = None
+_state_path: Optional[str] = None
+#совпадение, которое доставляется прямо сейчас
+_inflight: Optional[tuple] = None
+
+_stats: Dict[str, Any] = {"published": 0, "delivered": 0, "failed": 0, "filtered": 0, "last_latency_ms": None}
+
+
+def enabled() -> bool:
+    return EMBEDDED_REPOSTER and _queue is not None
+
+
+async def publish(target: Optional[Dict[str, Any]], log: Dict[str, Any], matches: List[Dict[str, Any]],
+                  saved: "asyncio.Future"):
+    #Вызывается из _process_message до окончания записи в БД; saved — задача save_message
+    #(нужна, только если id таргета ещё не известен кэшу)
+    await _queue.put((time.perf_counter(), target, log, matches, saved))
+    _stats["published"] += 1
+
+
+def _passes(filters: Dict[str, Any], log: Dict[str, Any]) -> bool:
+    #Та же логика, что у SQL /subscriptions/{chat_id}/feed: пустой фильтр — без ограничения
+    for key, field in (("trigger_ids", "matched_trigger_id"), ("target_ids", "target_id"), ("author_ids", "author_id")):
+        allowed = filters.get(key)
+        if allowed and log.get(field) not in allowed:
+            return False
+    return True
+
+
+async def _target_id(target: Optional[Dict[str, Any]], saved) -> Optional[int]:
+    if not target or not target.get("tg_id"):
+        return None
+    target_id = fastpath.known_target_id(target["tg_id"])
+    if target_id is None:
+        #новый чат — ждём upsert таргета
+        try:
+            target_id = await asyncio.shield(saved)
+        except Exception:
+            target_id = None
+    return target_id
+
+
+async def _deliver():
+    global _inflight
+    import reposter_bot as rb
+    while True:
+        _inflight = await _queue.get()
+        started, target, log, matches, saved = _inflight
+        try:
+            target_id = await _target_id(target, saved)
+            targets_map = {target_id: target} if target_id is not None and target else {}
+            chats = rb.load_state(_state_path).get("chats", [])
+            for m in matches:
+                #триггер, привязанный к таргету, срабатывает только в своём чате (как в save_message)
+                if m.get("trigger_target_id") is not None and target_id is not None and m["trigger_target_id"] != target_id:
+                    continue
+                item = dict(log, target_id=target_id, matched_trigger_id=m["trigger_id"], matched_text=m["matched_text"])
+                msg = None
+                for chat in chats:
+                    filters = await fastpath.get_subscription_filters(chat)
+                    if filters is not None and not _passes(filters, item):
+                        _stats["filtered"] += 1
+                        continue
+                    if msg is None:
+                        msg = rb.format_log_message(item, targets_map)
+                    if await rb.send_to_chat(_bot, chat, msg):
+                        _stats["delivered"] += 1
+                    else:
+                        _stats["failed"] += 1
+            _stats["last_latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _stats["failed"] += 1
+            print("Embedded reposter delivery failed:", e)
+        finally:
+            _inflight = None
+            _queue.task_done()
+
+
+async def _delivered_upto(undelivered: List[tuple]) -> int:
+    #id последнего лога, до которого включительно всё доставлено: всё, кроме неотправленного.
+    #Логи пишутся только из _process_message, и каждое совпадение попадало в очередь
+    pairs = []
+    for _, target, log, _, saved in undelivered:
+        target_id = fastpath.known_target_id(target["tg_id"]) if target and target.get("tg_id") else None
+        if target_id is None and saved.done() and not saved.cancelled() and saved.exception() is None:
+            target_id = saved.result()
+        if target_id is not None and log.get("message_id") is not None:
+            pairs.append((target_id, log["message_id"]))
+    first = await fastpath.first_log_id(pairs) if pairs else None
+    if first is not None:
+        return first - 1
+    return await fastpath.latest_log_id()
+
+
+async def _sync_cursor(upto: int):
+    #Всё до upto уже доставлено: сдвигаем курсоры файла состояния,
+    #чтобы отдельный reposter_bot.py после переключения не прислал это повторно, а остальное — прислал
+    import reposter_bot as rb
+    state = rb.load_state(_state_path)
+    state["last_seen_id"] = max(int(state.get("last_seen_id", 0)), upto)
+    cursors = state.get("cursors") or {}
+    for chat in list(cursors):
+        cursors[chat] = max(int(cursors[chat]), upto)
+    rb.save_state(_state_path, state)
+
+
+async def start():
+    #Поднимает бота и доставку в текущем event loop (вызывать после fastpath.init_pool)
+    global _queue, _bot, _dp, _state_path
+    if not EMBEDDED_REPOSTER or _queue is not None:
+        return
+    import reposter_bot as rb
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.default import DefaultBotProperties
+
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        raise RuntimeError("BOT_TOKEN required for EMBEDDED_REPOSTER")
+    _state_path = os.getenv("REPOSTER_STATE_PATH", rb.STATE_PATH_DEFAULT)
+    api_url = os.getenv("FASTAPI_URL", "http://localhost:8000")
+
+    state = rb.load_state(_state_path)
+    auto_chat = os.getenv("TARGET_CHAT_ID")
+    if auto_chat:
+        try:
+            cid = int(auto_chat)
+            if cid not in state.get("chats", []):
+                state.setdefault("chats", []).append(cid)
+                rb.save_state(_state_path, state)
+                print("Auto-subscribed chat id from env:", cid)
+        except ValueError:
+            pass
+
+    _bot = Bot(token=token, default=DefaultBotProperties(parse_mode="HTML"))
+    _dp = Dispatcher()
+    #команды бота ходят в API по HTTP, как и у отдельного процесса
+    rb.register_handlers(_dp, _state_path, api_url)
+    _queue = asyncio.Queue(maxsize=EMBEDDED_QUEUE_SIZE)
+    _tasks.append(asyncio.create_task(_deliver()))
+    #сигналы обрабатывает uvicorn
+    _tasks.append(asyncio.create_task(_dp.start_polling(_bot, handle_signals=False)))
+    print("Embedded reposter started")
+
+
+async def stop():
+    #Вызывать после остановки Telethon-клиента: новых совпадений уже не будет
+    global _queue, _bot, _dp
+    if _queue is None:
+        return
+    try:
+        await _dp.stop_polling()
+    except RuntimeError:
+        pass
+    #досылаем уже принятые совпадения
+    try:
+        await asyncio.wait_for(_queue.join(), EMBEDDED_DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"Embedded reposter: {_queue.qsize()} matches not delivered in {EMBEDDED_DRAIN_TIMEOUT}s")
+    #что не успели (включая недоставленное до конца текущее) — оставим отдельному репостеру
+    undelivered = [_inflight] if _inflight is not None else []
+    while not _queue.empty():
+        undelivered.append(_queue.get_nowait())
+    for t in _tasks:
+        t.cancel()
+    for t in _tasks:
+        try:
+            await t
+        except (asyncio.CancelledError, Exception):
+            pass
+    _tasks.clear()
+    try:
+        await _sync_cursor(await _delivered_upto(undelivered))
+    except Exception as e:
+        print("Embedded reposter: cursor sync failed:", e)
+    await _bot.session.close()
+    _queue = _bot = _dp = None
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "enabled": enabled(),
+        "depth": _queue.qsize() if _queue is not None else 0,
+        "capacity": EMBEDDED_QUEUE_SIZE,
+        **_stats,
+    }
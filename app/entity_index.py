@@ -0,0 +1,189 @@
+import os
+import re
+import time
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+#Локальный индекс диалогов и сущностей (username -> entity) и TTL-кэш результатов поиска.
+#Индекс перестраивается в фоне, поиск и резолв по нему не ходят в сеть.
+
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "300"))
+SEARCH_CACHE_MAX = int(os.getenv("SEARCH_CACHE_MAX", "1000"))
+DIALOG_INDEX_REFRESH = float(os.getenv("DIALOG_INDEX_REFRESH", "600"))
+
+_by_username: Dict[str, Any] = {}
+_by_id: Dict[int, Any] = {}
+_dialogs: List[Dict[str, Any]] = []
+_search_cache: Dict[Tuple[str, int], Tuple[float, List[Dict[str, Any]]]] = {}
+_refresh_task: Optional[asyncio.Task] = None
+_last_refresh = 0.0
+
+_LINK_RE = re.compile(r"^(?:https?://)?(?:www\.)?(?:t|telegram)\.(?:me|dog)/(?:s/)?([^/?#]+)", re.IGNORECASE)
+_USERNAME_RE = re.compile(r"^[a-z][a-z0-9_]{3,}$", re.IGNORECASE)
+
+
+def normalize_username(username_or_link: str) -> Optional[str]:
+    #@name, name, t.me/name, https://t.me/name -> "name" в нижнем регистре.
+    #Для инвайт-ссылок (t.me/+hash, joinchat) возвращает None — их резолвит только Telegram.
+    s = (username_or_link or "").strip()
+    m = _LINK_RE.match(s)
+    if m:
+        s = m.group(1)
+    s = s.lstrip("@")
+    if not _USERNAME_RE.match(s):
+        return None
+    return s.lower()
+
+
+def _record(ent, title: Optional[str] = None) -> Dict[str, Any]:
+    title = title or getattr(ent, "title", None) or getattr(ent, "username", None)
+    return {
+        "kind": ent.__class__.__name__,
+        "id": getattr(ent, "id", None),
+        "access_hash": getattr(ent, "access_hash", None),
+        "username": getattr(ent, "username", None),
+        "title": title,
+        "title_lc": (title or "").lower(),
+    }
+
+
+def _entity(rec: Dict[str, Any]):
+    #Минимальная сущность Telethon из записи снимка: id + access_hash хватает для запросов
+    #(JoinChannelRequest и т.п.) без похода в Telegram за резолвом username. None — восстановить нельзя
+    from telethon.tl import types
+    if rec.get("id") is None or rec.get("access_hash") is None:
+        return None
+    if rec["kind"] == "Channel":
+        return types.Channel(id=rec["id"], title=rec.get("title") or "", photo=types.ChatPhotoEmpty(), date=None,
+                             access_hash=rec["access_hash"], username=rec.get("username"))
+    if rec["kind"] == "User":
+        return types.User(id=rec["id"], access_hash=rec["access_hash"], username=rec.get("username"),
+                          first_name=rec.get("title"))
+    return None
+
+
+def remember(ent):
+    #Добавляет сущность в индекс (из диалогов, результатов поиска, входящих сообщений)
+    if ent is None:
+        return
+    eid = getattr(ent, "id", None)
+    if eid is not None:
+        _by_id[eid] = ent
+    uname = getattr(ent, "username", None)
+    if uname:
+        _by_username[uname.lower()] = ent
+
+
+def resolve(username_or_link: str):
+    #Сущность из индекса или None, если её там нет
+    key = normalize_username(username_or_link)
+    if key is None:
+        return None
+    return _by_username.get(key)
+
+
+def get_by_id(eid: int):
+    return _by_id.get(eid)
+
+
+def search_local(query: str, limit: int = 20) -> List[Dict[str, Any]]:
+    #Поиск групп/каналов по названию среди своих диалогов
+    q = query.lower()
+    results = []
+    for d in _dialogs:
+        if d["kind"] != "User" and q in d["title_lc"]:
+            results.append({k: d[k] for k in ("kind", "id", "username", "title")})
+            if len(results) >= limit:
+                break
+    return results
+
+
+def cache_get(query: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+    key = (query.strip().lower(), limit)
+    hit = _search_cache.get(key)
+    if hit is None:
+        return None
+    ts, results = hit
+    if time.monotonic() - ts > SEARCH_CACHE_TTL:
+        _search_cache.pop(key, None)
+        return None
+    return results
+
+
+def cache_put(query: str, limit: int, results: List[Dict[str, Any]]):
+    if len(_search_cache) >= SEARCH_CACHE_MAX:
+        #выкидываем самые старые записи
+        for key, _ in sorted(_search_cache.items(), key=lambda kv: kv[1][0])[:SEARCH_CACHE_MAX // 10 or 1]:
+            _search_cache.pop(key, None)
+    _search_cache[(query.strip().lower(), limit)] = (time.monotonic(), results)
+
+
+async def refresh(client):
+    #Полный проход по диалогам; структуры подменяются целиком, читатели не видят полусобранный индекс
+    global _dialogs, _last_refresh
+    dialogs = []
+    async for dialog in client.iter_dialogs():
+        ent = dialog.entity
+        remember(ent)
+        dialogs.append(_record(ent, getattr(ent, "title", None) or getattr(ent, "username", None) or dialog.name))
+    _dialogs = dialogs
+    _last_refresh = time.time()
+    print(f"Dialog index refreshed: {len(dialogs)} dialogs, {len(_by_username)} usernames")
+
+
+def dialog_records() -> List[Dict[str, Any]]:
+    return list(_dialogs)
+
+
+def warm(records: List[Dict[str, Any]]):
+    #Индекс диалогов (для search_local) и username -> entity (для resolve) из снимка,
+    #пока не прошёл первый refresh; живые сущности из refresh/remember их потом заменят
+    global _dialogs
+    if _dialogs or not records:
+        return
+    _dialogs = list(records)
+    for rec in records:
+        if rec.get("username") and rec["username"].lower() in _by_username:
+            continue
+        ent = _entity(rec)
+        if ent is not None:
+            remember(ent)
+
+
+async def _refresh_loop(client, interval: float):
+    while True:
+        try:
+            await refresh(client)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("Dialog index refresh failed:", e)
+        await asyncio.sleep(interval)
+
+
+def start(client, interval: float = DIALOG_INDEX_REFRESH):
+    #Запускает фоновое обновление индекса
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(_refresh_loop(client, interval))
+
+
+async def stop():
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        try:
+            await _refresh_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        _refresh_task = None
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "dialogs": len(_dialogs),
+        "usernames": len(_by_username),
+        "entities": len(_by_id),
+        "search_cache": len(_search_cache),
+        "last_refresh": _last_refresh,
+    }
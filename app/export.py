@@ -0,0 +1,72 @@
+import io
+import csv
+import json
+import zlib
+from typing import Any, AsyncIterator, Dict, Optional
+from . import fastpath
+
+#Потоковая выгрузка логов (NDJSON/CSV, опционально gzip) из серверного курсора.
+#В памяти одновременно держится только одна пачка строк курсора.
+
+EXPORT_COLUMNS = [
+    "id", "target_id", "target_tg_id", "target_title", "target_username", "target_type",
+    "message_id", "author_id", "author_name", "text",
+    "matched_trigger_id", "matched_text", "created_at", "text_hash", "duplicate",
+]
+
+#сколько байт копим перед отдачей клиенту, чтобы не слать по чанку на строку
+FLUSH_BYTES = 64 * 1024
+
+
+def _row_dict(r) -> Dict[str, Any]:
+    d = {k: r[k] for k in EXPORT_COLUMNS}
+    if d["created_at"] is not None:
+        d["created_at"] = d["created_at"].isoformat()
+    return d
+
+
+async def _ndjson(rows) -> AsyncIterator[bytes]:
+    async for r in rows:
+        yield (json.dumps(_row_dict(r), ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def _csv(rows) -> AsyncIterator[bytes]:
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(EXPORT_COLUMNS)
+    async for r in rows:
+        d = _row_dict(r)
+        w.writerow([d[k] for k in EXPORT_COLUMNS])
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    #заголовок, если строк не было
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+async def stream_logs(fmt: str = "ndjson", gzip: bool = False, since_id: Optional[int] = None,
+                      until_id: Optional[int] = None, target_id: Optional[int] = None) -> AsyncIterator[bytes]:
+    #Генератор байтов для StreamingResponse
+    rows = fastpath.iter_logs_export(since_id=since_id, until_id=until_id, target_id=target_id)
+    lines = _csv(rows) if fmt == "csv" else _ndjson(rows)
+    #wbits=31 -> gzip-контейнер, сжимаем потоково
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    pending = []
+    size = 0
+    async for chunk in lines:
+        pending.append(chunk)
+        size += len(chunk)
+        if size >= FLUSH_BYTES:
+            data = b"".join(pending)
+            pending.clear()
+            size = 0
+            if gz:
+                data = gz.compress(data)
+            if data:
+                yield data
+    data = b"".join(pending)
+    if gz:
+        data = gz.compress(data) + gz.flush()
+    if data:
+        yield data
@@ -0,0 +1,493 @@
+import os
+import json
+import asyncpg
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional
+from dotenv import load_dotenv
+from . import versions
+
+#Быстрый слой доступа к БД для горячего пути сканера (asyncpg напрямую, без SQLAlchemy).
+#Все запросы — константные строки, поэтому asyncpg один раз готовит их на соединении
+#и дальше берёт prepared statement из своего кэша.
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "2"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))
+PG_STATEMENT_CACHE = int(os.getenv("PG_STATEMENT_CACHE", "256"))
+PG_COMMAND_TIMEOUT = float(os.getenv("PG_COMMAND_TIMEOUT", "10"))
+EXPORT_PREFETCH = int(os.getenv("EXPORT_PREFETCH", "2000"))
+#отдельный маленький пул для долгих потоковых чтений (выгрузка, бэктест): медленный клиент
+#держит соединение, пока читает, и не должен отнимать соединения у записи сообщений
+EXPORT_POOL_MAX = int(os.getenv("EXPORT_POOL_MAX", "2"))
+#таймаут разовых тяжёлых запросов (пересчёт роллапов), сек: PG_COMMAND_TIMEOUT для них мал,
+#а timeout=None в asyncpg означает тот же command_timeout пула
+PG_HEAVY_TIMEOUT = float(os.getenv("PG_HEAVY_TIMEOUT", "3600"))
+
+_pool: Optional[asyncpg.Pool] = None
+_export_pool: Optional[asyncpg.Pool] = None
+#tg_id -> (id, username, title, type) последних записанных таргетов: неизменившийся таргет не пишем повторно
+_target_cache: Dict[int, tuple] = {}
+#chat_id -> фильтры подписки; сбрасывается при смене версии "subscriptions"
+_subscription_cache: Dict[int, Optional[Dict[str, Any]]] = {}
+_subscription_cache_version = -1
+
+
+SQL_UPSERT_TARGET = """
+    INSERT INTO targets (tg_id, username, title, type)
+    VALUES ($1, $2, $3, $4)
+    ON CONFLICT (tg_id) DO UPDATE
+    SET username = COALESCE(EXCLUDED.username, targets.username),
+        title = COALESCE(EXCLUDED.title, targets.title),
+        type = COALESCE(EXCLUDED.type, targets.type)
+    RETURNING id
+"""
+
+SQL_INSERT_LOG = """
+    INSERT INTO logs (target_id, message_id, author_id, author_name, text, matched_trigger_id, matched_text, raw_json,
+                      text_hash, duplicate)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8::json, $9, $10)
+"""
+
+SQL_FEED = """
+    SELECT l.id, l.target_id, t.title AS target_title, t.username AS target_username,
+           l.message_id, l.author_id, l.author_name, l.text,
+           l.matched_trigger_id, l.matched_text, l.created_at, l.text_hash, l.duplicate
+    FROM logs l
+    LEFT JOIN targets t ON t.id = l.target_id
+    ORDER BY l.created_at DESC
+    LIMIT $1 OFFSET $2
+"""
+
+#курсорное чтение для репостеров: только новее since_id, по возрастанию id
+SQL_FEED_SINCE = """
+    SELECT l.id, l.target_id, t.title AS target_title, t.username AS target_username,
+           l.message_id, l.author_id, l.author_name, l.text,
+           l.matched_trigger_id, l.matched_text, l.created_at, l.text_hash, l.duplicate
+    FROM logs l
+    LEFT JOIN targets t ON t.id = l.target_id
+    WHERE l.id > $1
+    ORDER BY l.id
+    LIMIT $2
+"""
+
+#лента подписчика: WHERE собирается только из заданных фильтров (см. _subscription_feed_sql),
+#чтобы планировщик использовал индексы logs_*_idx, а не общий план с "$n IS NULL OR ..."
+SQL_SUBSCRIPTION_FEED = """
+    SELECT l.id, l.target_id, t.title AS target_title, t.username AS target_username,
+           l.message_id, l.author_id, l.author_name, l.text,
+           l.matched_trigger_id, l.matched_text, l.created_at, l.text_hash, l.duplicate
+    FROM logs l
+    LEFT JOIN targets t ON t.id = l.target_id
+    WHERE {where}
+    ORDER BY l.id
+    LIMIT $2
+"""
+
+#инкрементальные роллапы срабатываний; {table}/{unit} подставляются из STAT_PERIODS
+SQL_STAT_UPSERT = """
+    INSERT INTO {table} (trigger_id, target_id, bucket, hits)
+    VALUES ($1, $2, date_trunc('{unit}', now()), $3)
+    ON CONFLICT (trigger_id, target_id, bucket) DO UPDATE SET hits = {table}.hits + EXCLUDED.hits
+"""
+
+SQL_STAT_SERIES = """
+    SELECT trigger_id, NULLIF(target_id, 0) AS target_id, bucket, hits
+    FROM {table}
+    WHERE bucket >= $1 AND bucket < $2
+      AND ($3::int IS NULL OR trigger_id = $3)
+      AND ($4::int IS NULL OR target_id = $4)
+    ORDER BY bucket, trigger_id, target_id
+    LIMIT $5
+"""
+
+SQL_STAT_TOP = """
+    SELECT trigger_id, NULLIF(target_id, 0) AS target_id, sum(hits)::bigint AS hits
+    FROM {table}
+    WHERE bucket >= $1 AND bucket < $2
+    GROUP BY trigger_id, target_id
+    ORDER BY hits DESC
+    LIMIT $3
+"""
+
+#период -> (таблица, единица date_trunc)
+STAT_PERIODS = {
+    "hour": ("trigger_stats_hourly", "hour"),
+    "day": ("trigger_stats_daily", "day"),
+}
+
+#$n::bigint IS NULL — необязательные фильтры в одном prepared statement
+SQL_EXPORT = """
+    SELECT l.id, l.target_id, t.tg_id AS target_tg_id, t.title AS target_title,
+           t.username AS target_username, t.type AS target_type,
+           l.message_id, l.author_id, l.author_name, l.text,
+           l.matched_trigger_id, l.matched_text, l.created_at, l.text_hash, l.duplicate
+    FROM logs l
+    LEFT JOIN targets t ON t.id = l.target_id
+    WHERE ($1::bigint IS NULL OR l.id > $1)
+      AND ($2::bigint IS NULL OR l.id <= $2)
+      AND ($3::int IS NULL OR l.target_id = $3)
+    ORDER BY l.id
+"""
+
+#от новых к старым по первичному ключу: первая пачка приходит сразу, без сортировки всей истории.
+#Окно по времени и повторы одного сообщения (строка на каждый триггер) отсекает iter_backtest_texts
+SQL_BACKTEST_TEXTS = """
+    SELECT l.target_id, l.message_id, l.text, l.created_at
+    FROM logs l
+    WHERE l.text IS NOT NULL
+    ORDER BY l.id DESC
+"""
+
+#сколько последних (target_id, message_id) помнить для отсечения повторов: строки одного сообщения
+#пишутся одной транзакцией и лежат рядом по id
+BACKTEST_DEDUP_WINDOW = 10000
+
+
+def _dsn(url: str) -> str:
+    #asyncpg не понимает диалект SQLAlchemy вида postgresql+asyncpg://
+    return url.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+
+async def init_pool():
+    #Создаёт пул соединений (один раз на процесс)
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            _dsn(DATABASE_URL),
+            min_size=PG_POOL_MIN,
+            max_size=PG_POOL_MAX,
+            statement_cache_size=PG_STATEMENT_CACHE,
+            command_timeout=PG_COMMAND_TIMEOUT,
+        )
+    return _pool
+
+
+async def close_pool():
+    global _pool, _export_pool
+    if _export_pool is not None:
+        await _export_pool.close()
+        _export_pool = None
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def get_export_pool() -> asyncpg.Pool:
+    #Пул серверных курсоров; создаётся при первой выгрузке. Сверх EXPORT_POOL_MAX выгрузки ждут очереди
+    global _export_pool
+    if _export_pool is None:
+        _export_pool = await asyncpg.create_pool(
+            _dsn(DATABASE_URL),
+            min_size=0,
+            max_size=EXPORT_POOL_MAX,
+            statement_cache_size=PG_STATEMENT_CACHE,
+            command_timeout=PG_COMMAND_TIMEOUT,
+        )
+    return _export_pool
+
+
+def has_pool() -> bool:
+    return _pool is not None
+
+
+async def get_pool() -> asyncpg.Pool:
+    return _pool or await init_pool()
+
+
+def _cached_target_id(tgid: int, username, title, typ) -> Optional[int]:
+    #id таргета из кэша, если новые значения ничего не меняют (None = "оставить как есть")
+    hit = _target_cache.get(tgid)
+    if hit is None:
+        return None
+    for new, old in zip((username, title, typ), hit[1:]):
+        if new is not None and new != old:
+            return None
+    return hit[0]
+
+
+def known_target_id(tgid: int) -> Optional[int]:
+    #id таргета из кэша без сверки полей (None — таргет ещё не записан этим процессом)
+    hit = _target_cache.get(tgid)
+    return hit[0] if hit else None
+
+
+def target_cache_rows() -> List[List[Any]]:
+    #Содержимое кэша таргетов для снимка: [tg_id, id, username, title, type]
+    return [[tgid, *hit] for tgid, hit in _target_cache.items()]
+
+
+def warm_targets(rows: List[List[Any]]):
+    #Кэш таргетов из снимка; уже известные этому процессу записи не трогаем.
+    #До первой записи в БД снимок сверяется с targets (verify_target_cache)
+    for tgid, target_id, username, title, typ in rows:
+        _target_cache.setdefault(int(tgid), (target_id, username, title, typ))
+    if rows:
+        versions.bump("targets")
+
+
+async def verify_target_cache() -> int:
+    #Оставляет в кэше только пары tg_id -> id, совпадающие с таблицей targets: после восстановления БД
+    #или смены DATABASE_URL id из снимка могут отсутствовать или принадлежать другому чату.
+    #Возвращает число выкинутых записей
+    if not _target_cache:
+        return 0
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("SELECT tg_id, id FROM targets WHERE tg_id = ANY($1::bigint[])", list(_target_cache))
+    actual = {r["tg_id"]: r["id"] for r in rows}
+    stale = [tgid for tgid, hit in _target_cache.items() if actual.get(tgid) != hit[0]]
+    for tgid in stale:
+        _target_cache.pop(tgid, None)
+    if stale:
+        print(f"Target cache: dropped {len(stale)} stale entries")
+    return len(stale)
+
+
+def _remember_target(target_id: int, tgid: int, username, title, typ):
+    hit = _target_cache.get(tgid) or (target_id, None, None, None)
+    _target_cache[tgid] = (
+        target_id,
+        username if username is not None else hit[1],
+        title if title is not None else hit[2],
+        typ if typ is not None else hit[3],
+    )
+    versions.bump("targets")
+
+
+async def upsert_target(tgid: int, username: str = None, title: str = None, typ: str = None) -> int:
+    #Один запрос вместо SELECT + UPDATE/INSERT, возвращает внутренний id
+    pool = await get_pool()
+    target_id = _cached_target_id(tgid, username, title, typ)
+    if target_id is None:
+        async with pool.acquire() as conn:
+            target_id = await conn.fetchval(SQL_UPSERT_TARGET, tgid, username, title, typ)
+        _remember_target(target_id, tgid, username, title, typ)
+    return target_id
+
+
+async def upsert_targets(rows: List[Dict[str, Any]]):
+    #Пакетный upsert таргетов: [{"tg_id", "username", "title", "type"}]
+    rows = [r for r in rows if r.get("tg_id")]
+    if not rows:
+        return
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await conn.executemany(
+            SQL_UPSERT_TARGET,
+            [(r["tg_id"], r.get("username"), r.get("title"), r.get("type")) for r in rows]
+        )
+    #id после executemany неизвестны — просто сбрасываем кэш для этих tg_id
+    for r in rows:
+        _target_cache.pop(r["tg_id"], None)
+    versions.bump("targets")
+
+
+async def save_message(target: Optional[Dict[str, Any]], log: Dict[str, Any], matches: List[Dict[str, Any]]) -> Optional[int]:
+    #Unit of work на одно сообщение: upsert таргета и все логи совпадений в одной транзакции.
+    #target - {"tg_id", "username", "title", "type"} или None
+    #log - общие поля сообщения (message_id, author_id, author_name, text, raw_json)
+    #matches - [{"trigger_id", "trigger_target_id", "matched_text"}]
+    #Возвращает внутренний id таргета
+    target_id = None
+    fresh_target = False
+    if target and target.get("tg_id"):
+        target_id = _cached_target_id(target["tg_id"], target.get("username"), target.get("title"), target.get("type"))
+        fresh_target = target_id is None
+    #известный неизменившийся таргет и нет совпадений — в БД писать нечего
+    if not fresh_target and not matches:
+        return target_id
+
+    pool = await get_pool()
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if fresh_target:
+                    target_id = await conn.fetchval(
+                        SQL_UPSERT_TARGET,
+                        target["tg_id"], target.get("username"), target.get("title"), target.get("type")
+                    )
+
+                raw = log.get("raw_json")
+                raw_s = json.dumps(raw, default=str) if raw is not None else None
+                rows = [
+                    (
+                        target_id, log.get("message_id"), log.get("author_id"), log.get("author_name"),
+                        log.get("text"), m["trigger_id"], m["matched_text"], raw_s,
+                        log.get("text_hash"), bool(log.get("duplicate"))
+                    )
+                    for m in matches
+                    #триггер, привязанный к таргету, срабатывает только в своём чате
+                    if m.get("trigger_target_id") is None or target_id is None or m["trigger_target_id"] == target_id
+                ]
+                if rows:
+                    await conn.executemany(SQL_INSERT_LOG, rows)
+                    await _bump_stats(conn, rows)
+    except Exception:
+        #id таргета из кэша мог оказаться неверным (нарушен внешний ключ) — в следующий раз делаем upsert
+        if target and target.get("tg_id"):
+            _target_cache.pop(target["tg_id"], None)
+        raise
+    #кэш и версии обновляем только после успешного commit
+    if fresh_target:
+        _remember_target(target_id, target["tg_id"], target.get("username"), target.get("title"), target.get("type"))
+    if rows:
+        versions.bump("logs")
+    return target_id
+
+
+async def latest_log_id() -> int:
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return int(await conn.fetchval("SELECT COALESCE(MAX(id), 0) FROM logs"))
+
+
+async def first_log_id(pairs: List[tuple]) -> Optional[int]:
+    #Наименьший id лога среди сообщений [(target_id, message_id)] или None, если их нет в logs
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetchval(
+            """
+            SELECT MIN(l.id) FROM logs l
+            JOIN unnest($1::int[], $2::bigint[]) AS u(target_id, message_id)
+              ON l.target_id = u.target_id AND l.message_id = u.message_id
+            """,
+            [p[0] for p in pairs], [p[1] for p in pairs]
+        )
+
+
+async def _bump_stats(conn, rows):
+    #Счётчики триггер × таргет для только что записанных логов (в той же транзакции)
+    counts: Dict[tuple, int] = {}
+    for r in rows:
+        key = (r[5], r[0] or 0)
+        counts[key] = counts.get(key, 0) + 1
+    #сортировка — одинаковый порядок блокировок строк у параллельных воркеров, без дедлоков
+    args = [(trigger_id, target_id, n) for (trigger_id, target_id), n in sorted(counts.items())]
+    for table, unit in STAT_PERIODS.values():
+        await conn.executemany(SQL_STAT_UPSERT.format(table=table, unit=unit), args)
+
+
+async def list_logs_with_targets(limit: int = 50, offset: int = 0, since_id: Optional[int] = None):
+    #Лента вместе с полями таргета одним запросом (без N+1 по get_target_by_id)
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        if since_id is not None:
+            return await conn.fetch(SQL_FEED_SINCE, since_id, limit)
+        return await conn.fetch(SQL_FEED, limit, offset)
+
+
+async def iter_logs_export(since_id: Optional[int] = None, until_id: Optional[int] = None,
+                           target_id: Optional[int] = None) -> AsyncIterator[asyncpg.Record]:
+    #Серверный курсор (DECLARE ... внутри транзакции): строки приходят пачками по EXPORT_PREFETCH,
+    #память не зависит от размера выгрузки. Соединение отдельного пула (EXPORT_POOL_MAX) занято, пока клиент читает поток.
+    pool = await get_export_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction(readonly=True, isolation="repeatable_read"):
+            async for r in conn.cursor(SQL_EXPORT, since_id, until_id, target_id, prefetch=EXPORT_PREFETCH):
+                yield r
+
+
+async def iter_backtest_texts(days: Optional[int] = None) -> AsyncIterator[asyncpg.Record]:
+    #Тексты сообщений за последние days дней (без повторов по триггерам) тем же серверным курсором.
+    #id и created_at растут вместе, поэтому на первой строке старше окна чтение заканчивается
+    since = datetime.now(timezone.utc) - timedelta(days=days) if days else None
+    seen: Dict[tuple, None] = {}
+    pool = await get_export_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction(readonly=True, isolation="repeatable_read"):
+            async for r in conn.cursor(SQL_BACKTEST_TEXTS, prefetch=EXPORT_PREFETCH):
+                if since is not None and r["created_at"] is not None and r["created_at"] < since:
+                    return
+                if r["message_id"] is not None:
+                    key = (r["target_id"], r["message_id"])
+                    if key in seen:
+                        continue
+                    seen[key] = None
+                    if len(seen) > BACKTEST_DEDUP_WINDOW:
+                        del seen[next(iter(seen))]
+                yield r
+
+
+def _subscription_feed_sql(filters: Dict[str, Any]) -> str:
+    #Константная строка на каждую комбинацию фильтров — у каждой свой prepared statement
+    where = ["l.id > $1"]
+    n = 3
+    for key, column, typ in (
+        ("trigger_ids", "l.matched_trigger_id", "int"),
+        ("target_ids", "l.target_id", "int"),
+        ("author_ids", "l.author_id", "bigint"),
+    ):
+        if filters.get(key):
+            where.append(f"{column} = ANY(${n}::{typ}[])")
+            n += 1
+    return SQL_SUBSCRIPTION_FEED.format(where=" AND ".join(where))
+
+
+async def get_subscription_filters(chat_id: int) -> Optional[Dict[str, Any]]:
+    #Фильтры подписки чата (None — подписки нет) с кэшем до следующего изменения подписок
+    global _subscription_cache_version
+    if _subscription_cache_version != versions.get("subscriptions"):
+        _subscription_cache.clear()
+        _subscription_cache_version = versions.get("subscriptions")
+    if chat_id in _subscription_cache:
+        return _subscription_cache[chat_id]
+    version = _subscription_cache_version
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(
+            "SELECT trigger_ids, target_ids, author_ids FROM subscriptions WHERE chat_id = $1", chat_id
+        )
+    filters = dict(row) if row else None
+    #подписку могли изменить, пока шёл запрос — тогда не кэшируем
+    if version == versions.get("subscriptions"):
+        _subscription_cache[chat_id] = filters
+    return filters
+
+
+async def list_subscription_feed(filters: Dict[str, Any], since_id: int = 0, limit: int = 50):
+    #Только записи, подходящие под фильтры подписчика, новее since_id
+    args = [since_id, limit] + [filters[k] for k in ("trigger_ids", "target_ids", "author_ids") if filters.get(k)]
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch(_subscription_feed_sql(filters), *args)
+
+
+async def stat_series(period: str, since, until, trigger_id: Optional[int] = None,
+                      target_id: Optional[int] = None, limit: int = 1000):
+    #Ряд счётчиков по бакетам — читается только из роллапа, без сканирования logs
+    table, _ = STAT_PERIODS[period]
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch(SQL_STAT_SERIES.format(table=table), since, until, trigger_id, target_id, limit)
+
+
+async def stat_top(period: str, since, until, limit: int = 10):
+    #Самые частые пары триггер × таргет за интервал
+    table, _ = STAT_PERIODS[period]
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch(SQL_STAT_TOP.format(table=table), since, until, limit)
+
+
+async def rebuild_stats():
+    #Пересчёт роллапов по всей истории logs (разово, для логов, записанных до появления роллапов).
+    #SHARE ROW EXCLUSIVE на оба роллапа: _bump_stats параллельной записи ждёт конца пересчёта
+    #и добавляет свои логи уже поверх (иначе — unique_violation на новом бакете или двойной счёт).
+    #Порядок таблиц тот же, что в _bump_stats
+    pool = await get_pool()
+    tables = ", ".join(table for table, _ in STAT_PERIODS.values())
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(f"LOCK TABLE {tables} IN SHARE ROW EXCLUSIVE MODE", timeout=PG_HEAVY_TIMEOUT)
+            for table, unit in STAT_PERIODS.values():
+                await conn.execute(f"DELETE FROM {table}", timeout=PG_HEAVY_TIMEOUT)
+                await conn.execute(f"""
+                    INSERT INTO {table} (trigger_id, target_id, bucket, hits)
+                    SELECT matched_trigger_id, COALESCE(target_id, 0), date_trunc('{unit}', created_at), count(*)
+                    FROM logs
+                    WHERE matched_trigger_id IS NOT NULL AND created_at IS NOT NULL
+                    GROUP BY 1, 2, 3
+                """, timeout=PG_HEAVY_TIMEOUT)
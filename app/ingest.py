@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+#Ограниченная очередь между обработчиком Telethon и пулом воркеров.
+#Обработчик только кладёт событие в очередь, обработку (get_chat, матчинг, запись в БД)
+#делают INGEST_WORKERS воркеров — память и число соединений с БД ограничены при любом потоке.
+#Политики переполнения (INGEST_OVERFLOW):
+#  block       — обработчик ждёт свободного места
+#  drop_oldest — выбрасывается самое старое сообщение без совпадений с триггерами
+#                (если таких нет — новое без совпадений; совпавшие не теряются, тогда ждём)
+#  spill       — лишнее пишется на диск (chat_id, message_id) и дочитывается, когда очередь разгрузится
+#                (свежие сообщения идут в память вне очереди к выгруженным — порядок не гарантируется).
+#                Курсор файла сдвигается по одной записи, только когда она уже в очереди; при ошибке
+#                загрузки пачка остаётся в файле и повторяется с нарастающей паузой
+
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "1000"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_OVERFLOW = os.getenv("INGEST_OVERFLOW", "block")
+INGEST_SPILL_PATH = os.getenv("INGEST_SPILL_PATH", "ingest_spill.jsonl")
+#сколько при остановке ждём, пока воркеры доберут очередь, сек
+INGEST_DRAIN_TIMEOUT = float(os.getenv("INGEST_DRAIN_TIMEOUT", "10"))
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "spill")
+#пауза опроса spill-файла и потолок паузы между повторами после ошибки загрузки, сек
+SPILL_POLL_INTERVAL = 1.0
+SPILL_RETRY_MAX = 60.0
+
+#элемент очереди: [событие, есть ли совпадение (None — ещё не проверяли)]
+_items: Deque[List[Any]] = deque()
+#события, которые воркеры обрабатывают прямо сейчас
+_inflight: List[Any] = []
+_cond: Optional[asyncio.Condition] = None
+_workers: List[asyncio.Task] = []
+_spill_task: Optional[asyncio.Task] = None
+_spill_offset = 0
+_spill_pending = 0
+
+_handler: Optional[Callable[[Any], Awaitable[None]]] = None
+_matcher: Optional[Callable[[Any], Optional[bool]]] = None
+_loader: Optional[Callable[[List[Dict[str, Any]]], Awaitable[List[Any]]]] = None
+#выгруженное дочитывается только после этого события (клиент подключён, старт завершён)
+_ready: Optional[asyncio.Event] = None
+
+_stats: Dict[str, int] = {
+    "enqueued": 0,
+    "processed": 0,
+    "errors": 0,
+    "dropped": 0,
+    "spilled": 0,
+    "unspilled": 0,
+    "max_depth": 0,
+}
+
+
+def _matched(item: List[Any]) -> bool:
+    if item[1] is None:
+        try:
+            res = _matcher(item[0]) if _matcher else True
+        except Exception:
+            res = True
+        if res is None:
+            #матчер пока не может ответить (триггеры не загружены) — не выкидываем и не запоминаем
+            return True
+        item[1] = bool(res)
+    return item[1]
+
+
+def _append(item: List[Any]):
+    _items.append(item)
+    _stats["enqueued"] += 1
+    _stats["max_depth"] = max(_stats["max_depth"], len(_items))
+    #на условии ждут и воркеры, и put — будим всех, иначе сигнал может достаться не тому
+    _cond.notify_all()
+
+
+def _drop_one_unmatched(incoming: List[Any]) -> Optional[str]:
+    #Освобождает место под входящее: "evicted" — выкинули самое старое несовпавшее из очереди,
+    #"rejected" — несовпавшее само входящее, None — выкидывать нечего
+    for i, item in enumerate(_items):
+        if not _matched(item):
+            del _items[i]
+            _stats["dropped"] += 1
+            return "evicted"
+    if not _matched(incoming):
+        _stats["dropped"] += 1
+        return "rejected"
+    return None
+
+
+def _spill(event):
+    global _spill_pending
+    #NewMessage.Event: id в event.message; Message (уже восстановленный из файла): event.id
+    msg = getattr(event, "message", None)
+    rec = {
+        "chat_id": getattr(event, "chat_id", None),
+        "message_id": getattr(event, "id", None) if isinstance(msg, str) else getattr(msg, "id", None),
+    }
+    with open(INGEST_SPILL_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps(rec) + "\n")
+    _spill_pending += 1
+    _stats["spilled"] += 1
+
+
+async def put(event):
+    #Вызывается из обработчика Telethon
+    item = [event, None]
+    async with _cond:
+        if len(_items) < INGEST_QUEUE_SIZE:
+            _append(item)
+            return
+        if INGEST_OVERFLOW == "spill":
+            _spill(event)
+            return
+        if INGEST_OVERFLOW == "drop_oldest":
+            dropped = _drop_one_unmatched(item)
+            if dropped == "evicted":
+                _append(item)
+            if dropped:
+                return
+        await _cond.wait_for(lambda: len(_items) < INGEST_QUEUE_SIZE)
+        _append(item)
+
+
+async def _worker():
+    while True:
+        async with _cond:
+            await _cond.wait_for(lambda: len(_items) > 0)
+            event = _items.popleft()[0]
+            _inflight.append(event)
+            #место освободилось — будим ждущий put
+            _cond.notify_all()
+        try:
+            await _handler(event)
+            _stats["processed"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _stats["errors"] += 1
+            print("Ingest worker failed:", e)
+        finally:
+            _inflight.remove(event)
+
+
+def _read_spill(offset: int, limit: int) -> List[Tuple[int, Optional[Dict[str, Any]]]]:
+    #До limit записей с offset: [(смещение за концом строки, запись или None для битой строки)]
+    batch = []
+    with open(INGEST_SPILL_PATH, "r", encoding="utf-8") as f:
+        f.seek(offset)
+        while len(batch) < limit:
+            line = f.readline()
+            if not line:
+                break
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                rec = None
+            batch.append((f.tell(), rec))
+    return batch
+
+
+async def _drain_spill():
+    #Дочитывает выгруженные на диск сообщения, когда очередь заполнена меньше чем наполовину
+    global _spill_offset, _spill_pending
+    if _ready is not None:
+        await _ready.wait()
+    failures = 0
+    while True:
+        await asyncio.sleep(min(SPILL_RETRY_MAX, SPILL_POLL_INTERVAL * 2 ** failures))
+        if _spill_pending <= 0 or len(_items) > INGEST_QUEUE_SIZE // 2:
+            continue
+        try:
+            batch = _read_spill(_spill_offset, max(INGEST_QUEUE_SIZE // 4, 1))
+            if not batch:
+                #файл короче счётчика (удалён снаружи) — дочитывать нечего
+                _spill_pending = 0
+            recs = [rec for _, rec in batch if rec is not None]
+            #одна загрузка на пачку; если упала — курсор не двигался, повторим всю пачку
+            events = iter(await _loader(recs) if recs else [])
+            for end, rec in batch:
+                event = next(events, None) if rec is not None else None
+                if event is not None:
+                    async with _cond:
+                        await _cond.wait_for(lambda: len(_items) < INGEST_QUEUE_SIZE)
+                        _append([event, None])
+                        _stats["unspilled"] += 1
+                #запись в очереди (или сообщения уже нет) — только теперь сдвигаем курсор
+                _spill_offset = end
+                _spill_pending -= 1
+            if _spill_pending <= 0:
+                #всё дочитано — начинаем файл заново
+                _spill_pending = 0
+                _spill_offset = 0
+                open(INGEST_SPILL_PATH, "w").close()
+            failures = 0
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            failures += 1
+            print("Ingest spill drain failed:", e)
+
+
+def start(handler, matcher=None, loader=None, ready=None):
+    #handler(event) — обработка; matcher(event) -> bool — есть ли совпадения (для drop_oldest),
+    #None — пока неизвестно (такое сообщение не выкидывается);
+    #loader(records) -> [event | None] — восстановление выгруженных на диск сообщений пачкой (для spill);
+    #ready — событие, после которого можно звать loader
+    global _cond, _handler, _matcher, _loader, _ready, _spill_task, _spill_pending
+    if INGEST_OVERFLOW not in OVERFLOW_POLICIES:
+        raise RuntimeError(f"INGEST_OVERFLOW must be one of {OVERFLOW_POLICIES}")
+    _handler, _matcher, _loader, _ready = handler, matcher, loader, ready
+    if _cond is None:
+        _cond = asyncio.Condition()
+    while len(_workers) < INGEST_WORKERS:
+        _workers.append(asyncio.create_task(_worker()))
+    if INGEST_OVERFLOW == "spill" and loader is not None and _spill_task is None:
+        #остатки с прошлого запуска тоже дочитываем
+        if os.path.exists(INGEST_SPILL_PATH):
+            with open(INGEST_SPILL_PATH, "r", encoding="utf-8") as f:
+                _spill_pending = sum(1 for _ in f)
+        _spill_task = asyncio.create_task(_drain_spill())
+
+
+async def stop():
+    #Вызывать до отключения клиента: воркеры добирают принятое (до INGEST_DRAIN_TIMEOUT).
+    #Что не успели, при политике spill уходит в файл и дочитается при следующем старте
+    global _spill_task
+    if _spill_task is not None:
+        _spill_task.cancel()
+        try:
+            await _spill_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        _spill_task = None
+    deadline = time.monotonic() + INGEST_DRAIN_TIMEOUT
+    while _workers and (_items or _inflight) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    left = list(_inflight) + [item[0] for item in _items]
+    _items.clear()
+    for t in _workers:
+        t.cancel()
+    for t in _workers:
+        try:
+            await t
+        except (asyncio.CancelledError, Exception):
+            pass
+    _workers.clear()
+    if not left:
+        return
+    if INGEST_OVERFLOW == "spill":
+        for event in left:
+            _spill(event)
+        print(f"Ingest: {len(left)} messages spilled to {INGEST_SPILL_PATH} on stop")
+    else:
+        print(f"Ingest: {len(left)} messages not processed in {INGEST_DRAIN_TIMEOUT}s")
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "policy": INGEST_OVERFLOW,
+        "depth": len(_items),
+        "capacity": INGEST_QUEUE_SIZE,
+        "workers": len(_workers),
+        "spill_pending": _spill_pending,
+        **_stats,
+    }
@@ -0,0 +1,210 @@
+import os
+import time
+import uuid
+import asyncio
+from typing import Any, Dict, List, Optional
+from .tele_client import join_by_username, leave_by_username
+from . import fastpath
+
+#Фоновые задания массового вступления/выхода из каналов.
+#Все запросы идут от одного аккаунта, поэтому задания выполняются по очереди одним воркером,
+#с паузой между запросами и ожиданием FloodWait вместо ошибки.
+
+JOIN_MIN_INTERVAL = float(os.getenv("JOIN_MIN_INTERVAL", "5"))
+JOIN_MAX_INTERVAL = float(os.getenv("JOIN_MAX_INTERVAL", "120"))
+JOB_UPSERT_BATCH = int(os.getenv("JOB_UPSERT_BATCH", "50"))
+JOB_MAX_RETRIES = int(os.getenv("JOB_MAX_RETRIES", "3"))
+JOBS_KEEP = int(os.getenv("JOBS_KEEP", "100"))
+
+_jobs: Dict[str, Dict[str, Any]] = {}
+_queue: Optional[asyncio.Queue] = None
+_worker_task: Optional[asyncio.Task] = None
+#текущая пауза между запросами: растёт после FloodWait и постепенно возвращается к минимуму
+_interval = JOIN_MIN_INTERVAL
+_last_request = 0.0
+
+
+def _dedupe(usernames: List[str]) -> List[str]:
+    seen = set()
+    out = []
+    for u in usernames:
+        u = (u or "").strip()
+        if u and u.lower() not in seen:
+            seen.add(u.lower())
+            out.append(u)
+    return out
+
+
+def create_job(action: str, usernames: List[str]) -> Dict[str, Any]:
+    #Ставит задание в очередь, возвращает его сводку
+    items = [{"username": u, "status": "pending", "msg": None, "id": None} for u in _dedupe(usernames)]
+    job = {
+        "id": uuid.uuid4().hex[:12],
+        "action": action,
+        "status": "queued",
+        "items": items,
+        "done": 0,
+        "failed": 0,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "flood_wait_until": None,
+        "item_seconds": None,
+    }
+    _jobs[job["id"]] = job
+    _trim()
+    _queue.put_nowait(job["id"])
+    return job
+
+
+def _trim():
+    #храним только последние JOBS_KEEP завершённых заданий
+    finished = [j for j in _jobs.values() if j["finished_at"]]
+    finished.sort(key=lambda j: j["finished_at"])
+    for j in finished[:max(0, len(finished) - JOBS_KEEP)]:
+        _jobs.pop(j["id"], None)
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return _jobs.get(job_id)
+
+
+def list_jobs() -> List[Dict[str, Any]]:
+    return sorted(_jobs.values(), key=lambda j: j["created_at"], reverse=True)
+
+
+def _remaining(job: Dict[str, Any]) -> int:
+    return len(job["items"]) - job["done"] - job["failed"]
+
+
+def eta_seconds(job: Dict[str, Any]) -> Optional[float]:
+    #Оценка до завершения: свои оставшиеся + всё, что стоит в очереди впереди
+    if job["finished_at"]:
+        return 0.0
+    per_item = max(_interval, job["item_seconds"] or 0.0)
+    ahead = sum(
+        _remaining(j) for j in _jobs.values()
+        if not j["finished_at"] and j["created_at"] < job["created_at"]
+    )
+    wait = 0.0
+    for j in _jobs.values():
+        if j["flood_wait_until"]:
+            wait = max(wait, j["flood_wait_until"] - time.time())
+    return round((ahead + _remaining(job)) * per_item + max(0.0, wait), 1)
+
+
+def summary(job: Dict[str, Any], with_items: bool = False) -> Dict[str, Any]:
+    out = {
+        "id": job["id"],
+        "action": job["action"],
+        "status": job["status"],
+        "total": len(job["items"]),
+        "done": job["done"],
+        "failed": job["failed"],
+        "eta_seconds": eta_seconds(job),
+    }
+    if with_items:
+        out["items"] = job["items"]
+    return out
+
+
+async def _pace():
+    #Выдерживает паузу между запросами к Telegram
+    global _last_request
+    delay = _last_request + _interval - time.monotonic()
+    if delay > 0:
+        await asyncio.sleep(delay)
+    _last_request = time.monotonic()
+
+
+async def _run_item(job: Dict[str, Any], item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    global _interval
+    fn = join_by_username if job["action"] == "join" else leave_by_username
+    for _ in range(JOB_MAX_RETRIES + 1):
+        await _pace()
+        r = await fn(item["username"])
+        wait = r.get("flood_wait")
+        if wait is None:
+            _interval = max(JOIN_MIN_INTERVAL, _interval * 0.9)
+            return r
+        #FloodWait: ждём сколько сказал Telegram и замедляемся
+        _interval = min(JOIN_MAX_INTERVAL, _interval * 1.5)
+        job["flood_wait_until"] = time.time() + wait
+        print(f"Job {job['id']}: flood wait {wait}s on {item['username']}")
+        await asyncio.sleep(wait + 1)
+        job["flood_wait_until"] = None
+    return r
+
+
+async def _flush(rows: List[Dict[str, Any]]):
+    if not rows:
+        return
+    try:
+        await fastpath.upsert_targets(rows)
+    except Exception as e:
+        print("Job target upsert failed:", e)
+    rows.clear()
+
+
+async def _run_job(job: Dict[str, Any]):
+    job["status"] = "running"
+    job["started_at"] = time.time()
+    pending_upserts: List[Dict[str, Any]] = []
+    for n, item in enumerate(job["items"], 1):
+        if item["status"] != "pending":
+            continue
+        r = await _run_item(job, item)
+        if r.get("ok"):
+            item["status"] = "done"
+            item["id"] = r.get("id")
+            job["done"] += 1
+            if job["action"] == "join":
+                pending_upserts.append({
+                    "tg_id": r.get("id"), "username": r.get("username"),
+                    "title": r.get("title"), "type": r.get("type")
+                })
+                if len(pending_upserts) >= JOB_UPSERT_BATCH:
+                    await _flush(pending_upserts)
+        else:
+            item["status"] = "failed"
+            job["failed"] += 1
+        item["msg"] = r.get("msg")
+        job["item_seconds"] = (time.time() - job["started_at"]) / n
+    await _flush(pending_upserts)
+    job["status"] = "finished"
+    job["finished_at"] = time.time()
+
+
+async def _worker():
+    while True:
+        job_id = await _queue.get()
+        job = _jobs.get(job_id)
+        if job is None:
+            continue
+        try:
+            await _run_job(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Job {job_id} crashed:", e)
+            job["status"] = "error"
+            job["finished_at"] = time.time()
+
+
+def start():
+    global _queue, _worker_task
+    if _queue is None:
+        _queue = asyncio.Queue()
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(_worker())
+
+
+async def stop():
+    global _worker_task
+    if _worker_task is not None:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        _worker_task = None
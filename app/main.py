@@ -1,34 +1,145 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from .db import init_models
 from .tele_client import start_client, stop_client, search_public, join_by_username, leave_by_username, refresh_triggers_cache
-from . import crud, schemas
-from typing import List
+from . import crud, schemas, fastpath, jobs, versions, export, ingest, match_cache, profiler, backtest, embedded
+from . import tele_client, snapshot
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta, timezone
+import os
 import re
+import time
+import asyncio
 
 
 app = FastAPI(title="Telegram human-like scanner")
 
+#токен для /admin/* (заголовок X-Admin-Token); без него админ-эндпоинты выключены
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def _require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(403, "admin endpoints disabled: set ADMIN_TOKEN")
+    if request.headers.get("x-admin-token") != ADMIN_TOKEN:
+        raise HTTPException(403, "forbidden")
+
+
+def _not_modified(request: Request, response: Response, tag: str):
+    #Условный GET: 304 без тела, если у клиента актуальная версия, иначе проставляем ETag
+    if versions.matches(request.headers.get("if-none-match", ""), tag):
+        return Response(status_code=304, headers={"ETag": tag})
+    response.headers["ETag"] = tag
+    return None
+
+#Ход старта для /readyz: длительность фаз (мс) и готовность
+_startup: Dict[str, Any] = {"ready": False, "phases_ms": {}, "schema_applied": None, "stale_targets": None, "snapshot": {}}
+
+
+async def _phase(name: str, fn):
+    t = time.perf_counter()
+    try:
+        res = fn()
+        if asyncio.iscoroutine(res):
+            res = await res
+        return res
+    finally:
+        _startup["phases_ms"][name] = round((time.perf_counter() - t) * 1000, 1)
+
+
+#пул asyncpg создан — можно писать логи
+_pool_ready = asyncio.Event()
+
+
+async def _start_db():
+    #Схема и пул независимы; триггеры и сверка кэша таргетов из снимка — после них
+    applied, _ = await asyncio.gather(_phase("schema", init_models), _phase("pool", fastpath.init_pool))
+    _startup["schema_applied"] = applied
+    _pool_ready.set()
+    _, stale = await asyncio.gather(
+        _phase("triggers", refresh_triggers_cache),
+        _phase("targets", fastpath.verify_target_cache),
+    )
+    _startup["stale_targets"] = stale
+
+
+async def _open_early(*steps):
+    #С триггерами из снимка обработка открывается, как только готовы пул, Telethon и встроенный репостер,
+    #не дожидаясь чтения триггеров из БД: свежие подменят снимок, а versions.bump("triggers")
+    #в refresh_triggers_cache сбросит кэш совпадений. Без снимка открывает startup_event
+    t = time.perf_counter()
+    await _pool_ready.wait()
+    await asyncio.gather(*steps)
+    if tele_client.trigger_rows():
+        tele_client.ready.set()
+        _startup["phases_ms"]["processing_open"] = round((time.perf_counter() - t) * 1000, 1)
+
+
 @app.on_event("startup")
 async def startup_event():
     #При старте приложения:
-    #1. Создаём таблицы в БД (если их нет)
-    #2. Запускаем Telethon-клиент для чтения сообщении
-    await init_models()
-    await start_client()
+    #1. Прогреваем кэши из локального снимка
+    #2. Параллельно: схема БД (пропускается при совпадении SCHEMA_VERSION) + пул + триггеры,
+    #   Telethon-клиент, встроенный репостер
+    #3. Открываем обработку сообщений (до этого они копятся в очереди ingest) — с триггерами из снимка
+    #   сразу после пула и клиента, иначе после чтения триггеров из БД
+    started = time.perf_counter()
+    _startup["snapshot"] = await _phase("snapshot", snapshot.load)
+    telegram = asyncio.ensure_future(_phase("telegram", start_client))
+    embedded_start = asyncio.ensure_future(_phase("embedded", embedded.start))
+    await asyncio.gather(_start_db(), telegram, embedded_start, _open_early(telegram, embedded_start))
+    tele_client.ready.set()
+    jobs.start()
+    _startup["phases_ms"]["total"] = round((time.perf_counter() - started) * 1000, 1)
+    _startup["ready"] = True
+    print("Startup phases (ms):", _startup["phases_ms"])
 
 @app.on_event("shutdown")
 async def shutdown_event():
     #При завершении отключаем клиент-Telethon
+    _startup["ready"] = False
+    await jobs.stop()
     await stop_client()
+    await embedded.stop()
+    backtest.shutdown()
+    try:
+        snapshot.save()
+    except Exception as e:
+        print("Startup snapshot save failed:", e)
+    await fastpath.close_pool()
 
 
-#Добавляем новые триггеры
-@app.post("/triggers", response_model=schemas.TriggerOut)
-async def create_trigger(payload: schemas.TriggerCreate):
-    p = payload.pattern.strip()
+#Жив ли процесс (без обращений к БД и Telegram)
+@app.get("/healthz")
+async def healthz():
+    return {"ok": True}
+
+#Готов ли обслуживать запросы: старт завершён, Telethon подключён, пул БД создан; иначе 503
+@app.get("/readyz")
+async def readyz(response: Response):
+    checks = {
+        "startup": _startup["ready"],
+        "telegram": tele_client.is_connected(),
+        "db": fastpath.has_pool(),
+    }
+    ready = all(checks.values())
+    if not ready:
+        response.status_code = 503
+    return {"ready": ready, "checks": checks, **{k: v for k, v in _startup.items() if k != "ready"}}
+
+
+def _normalize_pattern(pattern: str) -> str:
     #Автоматически формирует регулярку для обычного слова, если нет спецсимволов
+    p = pattern.strip()
     if not any(ch in p for ch in ".?*+|[](){}\\"):
         p = fr"\b{re.escape(p)}\w*\b"
+    return p
+
+
+#Добавляем новые триггеры
+@app.post("/triggers", response_model=schemas.TriggerOut)
+async def create_trigger(payload: schemas.TriggerCreate):
+    p = _normalize_pattern(payload.pattern)
     # если raw_text пустой – заполняем исходным текстом
     if not payload.raw_text:
         payload.raw_text = payload.pattern.strip()
@@ -45,7 +156,10 @@ async def create_trigger(payload: schemas.TriggerCreate):
 
 #Возвращает все триггеры
 @app.get("/triggers", response_model=List[schemas.TriggerOut])
-async def list_triggers():
+async def list_triggers(request: Request, response: Response):
+    cached = _not_modified(request, response, versions.etag("triggers"))
+    if cached:
+        return cached
     rows = await crud.get_triggers(enabled_only=False)
     return [
         schemas.TriggerOut(
@@ -63,9 +177,7 @@ async def list_triggers():
 #Обновление триггера по id
 @app.put("/triggers/{tid}", response_model=schemas.TriggerOut)
 async def update_trigger(tid: int, payload: schemas.TriggerCreate):
-    p = payload.pattern.strip()
-    if not any(ch in p for ch in ".?*+|[](){}\\"):
-        p = fr"\b{re.escape(p)}\w*\b"
+    p = _normalize_pattern(payload.pattern)
     payload.pattern = p
     if not payload.raw_text:
         payload.raw_text = payload.pattern
@@ -78,6 +190,23 @@ async def update_trigger(tid: int, payload: schemas.TriggerCreate):
         target_id=t.target_id, enabled=t.enabled
     )
 
+#Прогон кандидата в триггеры по истории (logs) или по локальному корпусу без сохранения
+@app.post("/triggers/backtest", response_model=schemas.BacktestOut)
+async def backtest_trigger(payload: schemas.BacktestRequest):
+    if payload.source not in ("logs", "corpus"):
+        raise HTTPException(400, "source must be logs or corpus")
+    pattern = _normalize_pattern(payload.pattern)
+    try:
+        res = await backtest.run(pattern, payload.flags or 0, source=payload.source, days=payload.days,
+                                 corpus=payload.corpus, max_messages=payload.max_messages)
+    except re.error as e:
+        raise HTTPException(400, f"bad pattern: {e}")
+    except backtest.ChunkTimeout as e:
+        raise HTTPException(400, str(e))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return res
+
 #Удаление триггера по id
 @app.delete("/triggers/{tid}")
 async def delete_trigger(tid: int):
@@ -93,37 +222,142 @@ async def create_target(payload: schemas.TargetCreate):
 
 #Получить список всех подписанных чатов
 @app.get("/targets", response_model=List[schemas.TargetOut])
-async def list_targets():
+async def list_targets(request: Request, response: Response):
+    cached = _not_modified(request, response, versions.etag("targets"))
+    if cached:
+        return cached
     rows = await crud.list_targets()
     return [schemas.TargetOut(id=r.id, tg_id=r.tg_id, username=r.username, title=r.title, type=r.type) for r in rows]
 
 #Получение ленты сообщений
 @app.get("/feed", response_model=List[schemas.LogOut])
-async def feed(limit: int = 50, offset: int = 0):
-    rows = await crud.list_logs(limit=limit, offset=offset)
-    out = []
-    for r in rows:
-        target_title = None
-        target_username = None
-        if r.target_id:
-            t = await crud.get_target_by_id(r.target_id)
-            if t:
-                target_title = t.title
-                target_username = t.username
-        out.append(schemas.LogOut(
-            id=r.id,
-            target_id=r.target_id,
-            target_title=target_title,
-            target_username=target_username,
-            message_id=r.message_id,
-            author_id=r.author_id,
-            author_name=r.author_name,
-            text=r.text,
-            matched_trigger_id=r.matched_trigger_id,
-            matched_text=r.matched_text,
-            created_at=r.created_at.isoformat() if r.created_at else None
-        ))
-    return out
+async def feed(request: Request, response: Response, limit: int = 50, offset: int = 0, since_id: Optional[int] = None):
+    #since_id — курсор репостера: записи новее since_id по возрастанию id (offset не используется)
+    #в ленте есть поля таргета, поэтому ETag зависит и от логов, и от таргетов
+    cached = _not_modified(request, response, versions.etag("logs", versions.get("targets"), limit, offset, since_id))
+    if cached:
+        return cached
+    rows = await fastpath.list_logs_with_targets(limit=limit, offset=offset, since_id=since_id)
+    return _logs_out(rows)
+
+def _logs_out(rows) -> List[schemas.LogOut]:
+    return [
+        schemas.LogOut(
+            id=r["id"],
+            target_id=r["target_id"],
+            target_title=r["target_title"],
+            target_username=r["target_username"],
+            message_id=r["message_id"],
+            author_id=r["author_id"],
+            author_name=r["author_name"],
+            text=r["text"],
+            matched_trigger_id=r["matched_trigger_id"],
+            matched_text=r["matched_text"],
+            created_at=r["created_at"].isoformat() if r["created_at"] else None,
+            text_hash=r["text_hash"],
+            duplicate=r["duplicate"]
+        )
+        for r in rows
+    ]
+
+def _subscription_out(r) -> schemas.SubscriptionOut:
+    return schemas.SubscriptionOut(
+        id=r.id, chat_id=r.chat_id,
+        trigger_ids=r.trigger_ids, target_ids=r.target_ids, author_ids=r.author_ids
+    )
+
+#Подписки чатов с фильтрами
+@app.get("/subscriptions", response_model=List[schemas.SubscriptionOut])
+async def list_subscriptions(request: Request, response: Response):
+    cached = _not_modified(request, response, versions.etag("subscriptions"))
+    if cached:
+        return cached
+    rows = await crud.list_subscriptions()
+    return [_subscription_out(r) for r in rows]
+
+#Создать/заменить фильтры подписки чата
+@app.put("/subscriptions/{chat_id}", response_model=schemas.SubscriptionOut)
+async def put_subscription(chat_id: int, payload: schemas.SubscriptionCreate):
+    data = {k: (v or None) for k, v in payload.dict().items()}
+    r = await crud.upsert_subscription(chat_id, data)
+    return _subscription_out(r)
+
+@app.get("/subscriptions/{chat_id}", response_model=schemas.SubscriptionOut)
+async def get_subscription(chat_id: int):
+    r = await crud.get_subscription(chat_id)
+    if r is None:
+        raise HTTPException(404, "subscription not found")
+    return _subscription_out(r)
+
+@app.delete("/subscriptions/{chat_id}")
+async def delete_subscription(chat_id: int):
+    await crud.delete_subscription(chat_id)
+    return {"ok": True}
+
+#Лента подписчика: только записи под его фильтры, новее since_id по возрастанию id
+@app.get("/subscriptions/{chat_id}/feed", response_model=List[schemas.LogOut])
+async def subscription_feed(chat_id: int, request: Request, response: Response, since_id: int = 0, limit: int = 50):
+    tag = versions.etag("logs", versions.get("targets"), versions.get("subscriptions"), chat_id, since_id, limit)
+    cached = _not_modified(request, response, tag)
+    if cached:
+        return cached
+    filters = await fastpath.get_subscription_filters(chat_id)
+    if filters is None:
+        raise HTTPException(404, "subscription not found")
+    rows = await fastpath.list_subscription_feed(filters, since_id=since_id, limit=limit)
+    return _logs_out(rows)
+
+def _stat_range(period: str, since: Optional[datetime], until: Optional[datetime], default_days: int):
+    if period not in fastpath.STAT_PERIODS:
+        raise HTTPException(400, "period must be hour or day")
+    until = until or datetime.now(timezone.utc)
+    since = since or until - timedelta(days=default_days)
+    return since, until
+
+#Статистика срабатываний по часам/дням (только из роллапов)
+@app.get("/stats/triggers", response_model=List[schemas.StatOut])
+async def stats_triggers(period: str = "day", since: Optional[datetime] = None, until: Optional[datetime] = None,
+                         trigger_id: Optional[int] = None, target_id: Optional[int] = None, limit: int = 1000):
+    since, until = _stat_range(period, since, until, 1 if period == "hour" else 30)
+    rows = await fastpath.stat_series(period, since, until, trigger_id=trigger_id, target_id=target_id, limit=limit)
+    return [
+        schemas.StatOut(trigger_id=r["trigger_id"], target_id=r["target_id"], bucket=r["bucket"].isoformat(), hits=r["hits"])
+        for r in rows
+    ]
+
+#Самые частые триггер × таргет за интервал
+@app.get("/stats/top", response_model=List[schemas.TopStatOut])
+async def stats_top(period: str = "day", since: Optional[datetime] = None, until: Optional[datetime] = None,
+                    limit: int = 10):
+    since, until = _stat_range(period, since, until, 7)
+    rows = await fastpath.stat_top(period, since, until, limit=limit)
+    return [schemas.TopStatOut(trigger_id=r["trigger_id"], target_id=r["target_id"], hits=r["hits"]) for r in rows]
+
+#Пересчитать роллапы по всей истории (для логов, записанных до их появления); только для админа —
+#пересчёт долгий и на время блокирует запись счётчиков
+@app.post("/stats/rebuild")
+async def stats_rebuild(request: Request):
+    _require_admin(request)
+    await fastpath.rebuild_stats()
+    return {"ok": True}
+
+#Потоковая выгрузка логов (NDJSON или CSV, опционально gzip) с полями таргета
+@app.get("/export/logs")
+async def export_logs(format: str = "ndjson", gzip: bool = False, since_id: Optional[int] = None,
+                      until_id: Optional[int] = None, target_id: Optional[int] = None):
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(400, "format must be ndjson or csv")
+    media = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    filename = f"logs.{format}" + (".gz" if gzip else "")
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if gzip:
+        #отдаём именно .gz-файл, а не прозрачное сжатие транспорта
+        media = "application/gzip"
+    return StreamingResponse(
+        export.stream_logs(format, gzip=gzip, since_id=since_id, until_id=until_id, target_id=target_id),
+        media_type=media,
+        headers=headers
+    )
 
 #Поиск публичных каналов/групп по названию
 @app.get("/search")
@@ -138,6 +372,8 @@ async def join(body: dict):
     if not username:
         raise HTTPException(400, "username required")
     r = await join_by_username(username)
+    if r.get("flood_wait"):
+        raise HTTPException(429, r.get("msg"), headers={"Retry-After": str(r["flood_wait"])})
     if not r.get("ok"):
         raise HTTPException(500, r.get("msg"))
     #обновляем/создаём таргет в БД
@@ -151,6 +387,69 @@ async def leave(body: dict):
     if not username:
         raise HTTPException(400, "username required")
     r = await leave_by_username(username)
+    if r.get("flood_wait"):
+        raise HTTPException(429, r.get("msg"), headers={"Retry-After": str(r["flood_wait"])})
     if not r.get("ok"):
         raise HTTPException(500, r.get("msg"))
     return {"ok": True, "left": True, "tg_id": r.get("id")}
+
+
+#Массовое вступление в каналы/группы (фоновое задание)
+@app.post("/jobs/join", response_model=schemas.JobOut)
+async def bulk_join(payload: schemas.BulkJobCreate):
+    if not payload.usernames:
+        raise HTTPException(400, "usernames required")
+    return jobs.summary(jobs.create_job("join", payload.usernames))
+
+#Массовый выход из каналов/групп (фоновое задание)
+@app.post("/jobs/leave", response_model=schemas.JobOut)
+async def bulk_leave(payload: schemas.BulkJobCreate):
+    if not payload.usernames:
+        raise HTTPException(400, "usernames required")
+    return jobs.summary(jobs.create_job("leave", payload.usernames))
+
+#Список заданий
+@app.get("/jobs", response_model=List[schemas.JobOut])
+async def list_jobs():
+    return [jobs.summary(j) for j in jobs.list_jobs()]
+
+#Прогресс задания
+@app.get("/jobs/{job_id}", response_model=schemas.JobOut)
+async def get_job(job_id: str):
+    job = jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(404, "job not found")
+    return jobs.summary(job, with_items=True)
+
+
+#Состояние очереди входящих сообщений: глубина, сброшенные, выгруженные на диск
+@app.get("/ingest/stats")
+async def ingest_stats():
+    return ingest.stats()
+
+#Метрики кэша совпадений по хэшу текста
+@app.get("/match-cache/stats")
+async def match_cache_stats():
+    return match_cache.stats()
+
+#Состояние встроенного репостера (EMBEDDED_REPOSTER)
+@app.get("/embedded/stats")
+async def embedded_stats():
+    return embedded.stats()
+
+#Сэмплирующий профиль процесса на N секунд в свёрнутом формате (flamegraph.pl, speedscope)
+@app.get("/admin/profile", response_class=PlainTextResponse)
+async def admin_profile(request: Request, seconds: float = 10, interval_ms: float = 5):
+    _require_admin(request)
+    if profiler.is_running():
+        raise HTTPException(409, "profile already running")
+    try:
+        return await profiler.profile(seconds, interval_ms / 1000)
+    except RuntimeError as e:
+        raise HTTPException(409, str(e))
+
+#Последние сообщения, обработка которых заняла больше SLOW_MESSAGE_MS, с разбивкой по этапам
+@app.get("/admin/slow-messages")
+async def admin_slow_messages(request: Request, limit: int = 50):
+    _require_admin(request)
+    return {"threshold_ms": profiler.SLOW_MESSAGE_MS, "items": profiler.slow_messages(limit)}
@@ -0,0 +1,80 @@
+import os
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+#LRU-кэш результатов матчинга по хэшу текста: одинаковые тексты (спам-рассылки, пересылки)
+#не прогоняются через все регулярки повторно. Ключ — хэш текста + версия набора триггеров,
+#при смене набора кэш сбрасывается.
+#Отдельно помним, в каком чате хэш встретился впервые, — так повтор из другого чата
+#помечается дубликатом без запросов к БД.
+
+MATCH_CACHE_SIZE = int(os.getenv("MATCH_CACHE_SIZE", "10000"))
+SEEN_CACHE_SIZE = int(os.getenv("SEEN_CACHE_SIZE", "50000"))
+
+_cache: "OrderedDict[tuple, List[Dict[str, Any]]]" = OrderedDict()
+_cache_version = None
+#хэш текста -> tg_id чата, где он встретился впервые
+_seen: "OrderedDict[str, Any]" = OrderedDict()
+
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "resets": 0, "duplicates": 0}
+
+
+def text_hash(text: str) -> str:
+    return hashlib.blake2b((text or "").encode("utf-8"), digest_size=16).hexdigest()
+
+
+def get(h: str, version: int, count: bool = True) -> Optional[List[Dict[str, Any]]]:
+    #Совпадения для текста или None, если его ещё не матчили при этой версии триггеров
+    global _cache_version
+    if version != _cache_version:
+        if _cache:
+            _stats["resets"] += 1
+        _cache.clear()
+        _cache_version = version
+    key = (h, version)
+    matches = _cache.get(key)
+    if matches is None:
+        if count:
+            _stats["misses"] += 1
+        return None
+    _cache.move_to_end(key)
+    if count:
+        _stats["hits"] += 1
+    return matches
+
+
+def put(h: str, version: int, matches: List[Dict[str, Any]]):
+    if version != _cache_version:
+        return
+    _cache[(h, version)] = matches
+    _cache.move_to_end((h, version))
+    while len(_cache) > MATCH_CACHE_SIZE:
+        _cache.popitem(last=False)
+        _stats["evictions"] += 1
+
+
+def is_cross_chat_duplicate(h: str, chat_id) -> bool:
+    #True, если этот текст уже приходил из другого чата
+    first = _seen.get(h)
+    if first is None:
+        _seen[h] = chat_id
+        if len(_seen) > SEEN_CACHE_SIZE:
+            _seen.popitem(last=False)
+        return False
+    _seen.move_to_end(h)
+    if first != chat_id:
+        _stats["duplicates"] += 1
+        return True
+    return False
+
+
+def stats() -> Dict[str, Any]:
+    total = _stats["hits"] + _stats["misses"]
+    return {
+        "size": len(_cache),
+        "capacity": MATCH_CACHE_SIZE,
+        "seen": len(_seen),
+        "hit_ratio": round(_stats["hits"] / total, 4) if total else None,
+        **_stats,
+    }
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Text, DateTime, ForeignKey, JSON, func
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Text, DateTime, ForeignKey, JSON, Index, func
+from sqlalchemy.dialects.postgresql import ARRAY
 from .db import Base
 
 #регулярка для поиска текста
@@ -35,4 +36,43 @@ class Log(Base):
     matched_trigger_id = Column(ForeignKey('triggers.id', ondelete='CASCADE'))
     matched_text = Column(String, nullable=True)
     raw_json = Column(JSON, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    #хэш текста (blake2b) и пометка "тот же текст уже приходил из другого чата"
+    text_hash = Column(String(32), nullable=True, index=True)
+    duplicate = Column(Boolean, default=False)
+
+    #индексы под отфильтрованные ленты подписчиков (фильтр + курсор по id)
+    __table_args__ = (
+        Index("logs_trigger_id_idx", "matched_trigger_id", "id"),
+        Index("logs_target_id_idx", "target_id", "id"),
+        Index("logs_author_id_idx", "author_id", "id"),
+    )
+
+
+#подписка чата репостера с фильтрами (NULL — без фильтра по этому полю)
+class Subscription(Base):
+    __tablename__ = "subscriptions"
+    id = Column(Integer, primary_key=True, index=True)
+    chat_id = Column(BigInteger, unique=True, nullable=False, index=True)
+    trigger_ids = Column(ARRAY(Integer), nullable=True)
+    target_ids = Column(ARRAY(Integer), nullable=True)
+    author_ids = Column(ARRAY(BigInteger), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+#почасовые/посуточные счётчики срабатываний триггер × таргет (target_id = 0 — без таргета),
+#обновляются в той же транзакции, что и запись логов
+class TriggerStatHourly(Base):
+    __tablename__ = "trigger_stats_hourly"
+    trigger_id = Column(Integer, ForeignKey("triggers.id", ondelete="CASCADE"), primary_key=True)
+    target_id = Column(Integer, primary_key=True, default=0)
+    bucket = Column(DateTime(timezone=True), primary_key=True, index=True)
+    hits = Column(BigInteger, nullable=False, default=0)
+
+
+class TriggerStatDaily(Base):
+    __tablename__ = "trigger_stats_daily"
+    trigger_id = Column(Integer, ForeignKey("triggers.id", ondelete="CASCADE"), primary_key=True)
+    target_id = Column(Integer, primary_key=True, default=0)
+    bucket = Column(DateTime(timezone=True), primary_key=True, index=True)
+    hits = Column(BigInteger, nullable=False, default=0)
@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+#Сэмплирующий профайлер по запросу (без сторонних зависимостей) и трассировка медленных сообщений.
+#Отдельный поток раз в interval снимает стеки всех потоков через sys._current_frames()
+#и копит их в "свёрнутом" формате (frame;frame;frame count) — его понимают flamegraph.pl,
+#speedscope и inferno. Пока профайлер не запущен, накладных расходов нет.
+
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+SLOW_MESSAGE_MS = float(os.getenv("SLOW_MESSAGE_MS", "0"))
+SLOW_MESSAGE_KEEP = int(os.getenv("SLOW_MESSAGE_KEEP", "200"))
+
+_running = threading.Lock()
+_slow: Deque[Dict[str, Any]] = deque(maxlen=SLOW_MESSAGE_KEEP)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _sample(seconds: float, interval: float) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for tid, frame in sys._current_frames().items():
+            if tid == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(tid, f"thread-{tid}"))
+            key = ";".join(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+        time.sleep(interval)
+    return counts
+
+
+def collapse(counts: Dict[str, int]) -> str:
+    return "".join(f"{stack} {n}\n" for stack, n in sorted(counts.items(), key=lambda kv: -kv[1]))
+
+
+def profile_blocking(seconds: float, interval: float = 0.005) -> str:
+    #Снимает профиль в текущем потоке (не из event loop). RuntimeError, если уже идёт другой
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    if not _running.acquire(blocking=False):
+        raise RuntimeError("profile already running")
+    try:
+        return collapse(_sample(seconds, max(interval, 0.001)))
+    finally:
+        _running.release()
+
+
+async def profile(seconds: float, interval: float = 0.005) -> str:
+    #То же для asyncio: сэмплер работает в отдельном потоке, event loop при этом не блокируется
+    return await asyncio.get_running_loop().run_in_executor(None, profile_blocking, seconds, interval)
+
+
+def is_running() -> bool:
+    return _running.locked()
+
+
+def record_slow(stages: Dict[str, float], info: Dict[str, Any]):
+    #Запоминает разбивку по этапам (мс), если сообщение обрабатывалось дольше SLOW_MESSAGE_MS
+    if SLOW_MESSAGE_MS <= 0:
+        return
+    total = sum(stages.values())
+    if total < SLOW_MESSAGE_MS:
+        return
+    entry = {"at": time.time(), "total_ms": round(total, 2), "stages_ms": {k: round(v, 2) for k, v in stages.items()}, **info}
+    _slow.append(entry)
+    print("Slow message:", entry)
+
+
+def slow_messages(limit: Optional[int] = None):
+    items = list(_slow)[::-1]
+    return items[:limit] if limit else items
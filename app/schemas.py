@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 
 #Схема создания триггера
 class TriggerCreate(BaseModel):
@@ -46,3 +46,83 @@ class LogOut(BaseModel):
     matched_trigger_id: Optional[int]
     matched_text: Optional[str]
     created_at: Optional[str]
+    text_hash: Optional[str] = None
+    duplicate: Optional[bool] = None
+
+#Схема создания массового задания join/leave
+class BulkJobCreate(BaseModel):
+    usernames: List[str]
+
+#Схема элемента задания
+class JobItemOut(BaseModel):
+    username: str
+    status: str
+    msg: Optional[str] = None
+    id: Optional[int] = None
+
+#Схема ответа задания
+class JobOut(BaseModel):
+    id: str
+    action: str
+    status: str
+    total: int
+    done: int
+    failed: int
+    eta_seconds: Optional[float] = None
+    items: Optional[List[JobItemOut]] = None
+
+#Схема фильтров подписки (пусто/None — без фильтра по полю)
+class SubscriptionCreate(BaseModel):
+    trigger_ids: Optional[List[int]] = None
+    target_ids: Optional[List[int]] = None
+    author_ids: Optional[List[int]] = None
+
+#Схема ответа подписки
+class SubscriptionOut(BaseModel):
+    id: int
+    chat_id: int
+    trigger_ids: Optional[List[int]] = None
+    target_ids: Optional[List[int]] = None
+    author_ids: Optional[List[int]] = None
+
+#Схема точки ряда статистики триггеров
+class StatOut(BaseModel):
+    trigger_id: int
+    target_id: Optional[int] = None
+    bucket: str
+    hits: int
+
+#Схема суммарной статистики триггер × таргет
+class TopStatOut(BaseModel):
+    trigger_id: int
+    target_id: Optional[int] = None
+    hits: int
+
+#Схема запроса бэктеста триггера
+class BacktestRequest(BaseModel):
+    pattern: str
+    flags: Optional[int] = 0
+    source: str = "logs"
+    days: Optional[int] = 30
+    corpus: Optional[str] = None
+    max_messages: Optional[int] = None
+
+#Пример совпадения из бэктеста
+class BacktestSample(BaseModel):
+    matched_text: str
+    text: str
+
+#Схема ответа бэктеста
+class BacktestOut(BaseModel):
+    pattern: str
+    source: str
+    messages: int
+    hit_messages: int
+    matches: int
+    hit_ratio: float
+    span_days: Optional[float] = None
+    est_hits_per_day: Optional[float] = None
+    cost_us_per_message: Optional[float] = None
+    wall_seconds: float
+    workers: int
+    samples: List[BacktestSample] = []
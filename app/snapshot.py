@@ -0,0 +1,52 @@
+import os
+import json
+import time
+from typing import Any, Dict
+from . import tele_client, fastpath, entity_index
+
+#Снимок тяжёлых кэшей (триггеры, таргеты, индекс диалогов) в локальном файле.
+#Пишется при остановке, читается первым делом при старте: кэши тёплые до ответа БД и Telegram,
+#затем их штатно заменяют свежие данные (refresh_triggers_cache, фоновое обновление индекса).
+
+STARTUP_SNAPSHOT_PATH = os.getenv("STARTUP_SNAPSHOT_PATH", "startup_snapshot.json")
+SNAPSHOT_VERSION = 2
+
+
+def save() -> bool:
+    if not STARTUP_SNAPSHOT_PATH:
+        return False
+    data = {
+        "version": SNAPSHOT_VERSION,
+        "saved_at": time.time(),
+        "triggers": tele_client.trigger_rows(),
+        "targets": fastpath.target_cache_rows(),
+        "dialogs": entity_index.dialog_records(),
+    }
+    tmp = STARTUP_SNAPSHOT_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, STARTUP_SNAPSHOT_PATH)
+    return True
+
+
+def load() -> Dict[str, Any]:
+    #Прогревает кэши из снимка; битый или чужой версии файл просто игнорируется
+    if not STARTUP_SNAPSHOT_PATH or not os.path.exists(STARTUP_SNAPSHOT_PATH):
+        return {}
+    try:
+        with open(STARTUP_SNAPSHOT_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print("Startup snapshot unreadable:", e)
+        return {}
+    if data.get("version") != SNAPSHOT_VERSION:
+        return {}
+    tele_client.warm_triggers(data.get("triggers") or [])
+    fastpath.warm_targets(data.get("targets") or [])
+    entity_index.warm(data.get("dialogs") or [])
+    return {
+        "triggers": len(data.get("triggers") or []),
+        "targets": len(data.get("targets") or []),
+        "dialogs": len(data.get("dialogs") or []),
+        "age_seconds": round(time.time() - float(data.get("saved_at") or 0), 1),
+    }
@@ -1,11 +1,15 @@
 import os
 import re
+import time
 import asyncio
 import json
+from typing import Optional
 from telethon import TelegramClient, events, functions
 from telethon.tl.functions.channels import JoinChannelRequest, LeaveChannelRequest
+from telethon.errors import FloodWaitError
 from dotenv import load_dotenv
-from .crud import get_triggers, upsert_target_by_tgid, create_log, get_target_by_tg_id
+from .crud import get_triggers
+from . import fastpath, entity_index, versions, ingest, match_cache, profiler, embedded
 
 load_dotenv()
 
@@ -24,43 +28,103 @@ _lock = asyncio.Lock()
 _my_id = None
 
 
+#сырые строки триггеров (для снимка кэшей при остановке)
+_trigger_rows = []
+#триггеры уже прочитаны из БД (а не только из снимка)
+_triggers_loaded = False
+#события копятся в очереди ingest, пока старт приложения не закончен (схема, пул, триггеры)
+ready = asyncio.Event()
+
+
+def _compile_triggers(rows):
+    #rows - [{"id", "target_id", "pattern", "flags"}]
+    compiled = [] #регулярные выражения
+    for r in rows:
+        try:
+            flags = (int(r["flags"] or 0) & ~re.LOCALE) | re.IGNORECASE #включить IGNORECASE и убрать LOCALE
+            creg = re.compile(r["pattern"], flags)
+            #pattern - регул. выражение в таблице trigger(шаблон)
+            #flags - числовое значение флагов рег.выраж.(применение шаблона)
+            compiled.append({"id": r["id"], "target_id": r["target_id"], "regex": creg})
+        except Exception as e:
+            print("Failed compile regex", r["id"], r["pattern"], e)
+    return compiled
+
+
 async def refresh_triggers_cache():
     #Компилирует регулярки из БД
-    global _compiled_triggers
+    global _compiled_triggers, _trigger_rows, _triggers_loaded
     async with _lock:
         rows = await get_triggers(enabled_only=True)
-        compiled = [] #регулярные выражения
-        for r in rows:
-            try:
-                flags = (int(r.flags or 0) & ~re.LOCALE) | re.IGNORECASE #включить IGNORECASE и убрать LOCALE
-                creg = re.compile(r.pattern, flags)
-                #pattern - регул. выражение в таблице trigger(шаблон)
-                #flags - числовое значение флагов рег.выраж.(применение шаблона)
-                compiled.append({"id": r.id, "target_id": r.target_id, "regex": creg})
-            except Exception as e:
-                print("Failed compile regex", r.id, r.pattern, e)
-        _compiled_triggers = compiled
-
-
-async def _process_message(chat, event):
+        _trigger_rows = [
+            {"id": r.id, "target_id": r.target_id, "pattern": r.pattern, "flags": r.flags} for r in rows
+        ]
+        _compiled_triggers = _compile_triggers(_trigger_rows)
+        _triggers_loaded = True
+        versions.bump("triggers")
+
+
+def warm_triggers(rows):
+    #Триггеры из снимка до первого чтения из БД: с ними обработка открывается, не дожидаясь БД
+    global _compiled_triggers, _trigger_rows
+    if _compiled_triggers or not rows:
+        return
+    _trigger_rows = list(rows)
+    _compiled_triggers = _compile_triggers(_trigger_rows)
+    versions.bump("triggers")
+
+
+def trigger_rows():
+    return list(_trigger_rows)
+
+
+def is_connected() -> bool:
+    return client.is_connected()
+
+
+def _message_id(event):
+    #id сообщения и для NewMessage.Event, и для Message (восстановленного из spill-файла очереди)
+    msg = getattr(event, "message", None)
+    if isinstance(msg, str):
+        return getattr(event, "id", None)
+    return getattr(msg, "id", None)
+
+
+def _has_match(event) -> Optional[bool]:
+    #Быстрая проверка для очереди: совпадает ли текст хоть с одним триггером.
+    #None — пока триггеры не прочитаны из БД: по снимку (он мог устареть) сообщения не выкидываем
+    if not _triggers_loaded:
+        return None
+    text = getattr(event, "raw_text", "") or ""
+    cached = match_cache.get(match_cache.text_hash(text), versions.get("triggers"), count=False)
+    if cached is not None:
+        return bool(cached)
+    return any(t["regex"].search(text) for t in _compiled_triggers)
+
+
+def _lap(stages, name, started) -> float:
+    #Добавляет длительность этапа (мс) в разбивку и возвращает новую отметку времени
+    now = time.perf_counter()
+    if stages is not None:
+        stages[name] = stages.get(name, 0.0) + (now - started) * 1000
+    return now
+
+
+async def _process_message(chat, event, stages=None):
     #Проверяет сообщение на триггеры и пишет лог
+    #stages — разбивка по этапам (мс) для трассировки медленных сообщений
+    t = time.perf_counter()
     text = getattr(event, "raw_text", "") or getattr(getattr(event, "message", None), "message", "") or ""
 
     if not _compiled_triggers:
         await refresh_triggers_cache()
+        t = _lap(stages, "refresh_triggers", t)
 
     tg_chat_id = getattr(chat, "id", None)
     chat_title = getattr(chat, "title", None) or getattr(chat, "name", None) or getattr(chat, "username", None)
     chat_username = getattr(chat, "username", None)
     chat_type = chat.__class__.__name__
 
-    #сохраняем target
-    db_target = None
-    if tg_chat_id:
-        db_target = await upsert_target_by_tgid(
-            tg_chat_id, username=chat_username, title=chat_title, typ=chat_type
-        )
-
     #получаем автора сразу
     author_name = None
     author_id = None
@@ -73,6 +137,7 @@ async def _process_message(chat, event):
             author_id = getattr(author, "id", None)
     except Exception:
         pass
+    t = _lap(stages, "get_sender", t)
 
     # пропускаем самого себя
     if author_id == BOT_AUTHOR_ID or author_name == BOT_AUTHOR_NAME:
@@ -80,103 +145,161 @@ async def _process_message(chat, event):
     if author_id == _my_id or (author_name and author_name == "Scanner_imitation_bot"):
         return
 
-    #сериализация raw_json
+    # проходим по триггерам и ищем ВСЕ совпадения
+    # (фильтр по target_id применяется в fastpath.save_message, когда известен id таргета)
+    # одинаковые тексты берём из кэша по хэшу, без повторного прогона регулярок
+    h = match_cache.text_hash(text)
+    trigger_version = versions.get("triggers")
+    matches = match_cache.get(h, trigger_version)
+    if matches is None:
+        matches = []
+        for trig in _compiled_triggers:
+            for m in trig["regex"].finditer(text or ""):
+                matches.append({
+                    "trigger_id": trig["id"],
+                    "trigger_target_id": trig["target_id"],
+                    "matched_text": m.group(0)
+                })
+        match_cache.put(h, trigger_version, matches)
+    duplicate = bool(matches) and match_cache.is_cross_chat_duplicate(h, tg_chat_id)
+    t = _lap(stages, "match", t)
+
+    #сериализация raw_json (нужна только если есть что логировать)
     raw = None
-    if hasattr(event, "to_dict"):
+    if matches and hasattr(event, "to_dict"):
         try:
             raw = json.loads(json.dumps(event.to_dict(), default=str))
         except Exception:
             raw = None
 
-    # проходим по триггерам и ищем ВСЕ совпадения
-    for t in _compiled_triggers:
-        # фильтрация по target_id
-        if t["target_id"] is not None and tg_chat_id is not None:
-            db_t = await get_target_by_tg_id(tg_chat_id)
-            if db_t is None or db_t.id != t["target_id"]:
-                continue
-
-        #проверка текста на совпадения с триггерами
-        for m in t["regex"].finditer(text or ""):
-            matched_trigger_id = t["id"]
-            matched_text = m.group(0)
-            try:
-                await create_log({
-                    "target_id": db_target.id if db_target else None,
-                    "message_id": getattr(getattr(event, "message", None), "id", None),
-                    "author_id": author_id,
-                    "author_name": author_name,
-                    "text": text,
-                    "matched_trigger_id": matched_trigger_id,
-                    "matched_text": matched_text,
-                    "raw_json": raw
-                })
-            except Exception as e:
-                print("Failed to create log:", e)
+    #сохраняем target и все логи одной транзакцией
+    target = None
+    if tg_chat_id:
+        target = {"tg_id": tg_chat_id, "username": chat_username, "title": chat_title, "type": chat_type}
+    log = {
+        "message_id": _message_id(event),
+        "author_id": author_id,
+        "author_name": author_name,
+        "text": text,
+        "text_hash": h,
+        "duplicate": duplicate,
+        "raw_json": raw
+    }
+    try:
+        save = fastpath.save_message(target, log, matches)
+        if matches and embedded.enabled():
+            #встроенный репостер получает совпадения сразу, запись в БД идёт параллельно
+            save = asyncio.ensure_future(save)
+            await embedded.publish(target, log, matches, save)
+            t = _lap(stages, "publish", t)
+        await save
+    except Exception as e:
+        print("Failed to save message:", e)
+    t = _lap(stages, "save", t)
 
     # параллельно выводим в консоль
     print(f"[{chat_title}] {author_name}: {text}")
 
+    if stages is not None:
+        profiler.record_slow(stages, {
+            "chat_id": tg_chat_id, "message_id": _message_id(event),
+            "matches": len(matches), "text_len": len(text)
+        })
+
 
 @client.on(events.NewMessage(incoming=True))
 async def _on_new_message(event):
     #Обработчик новых сообщений
     if event.out or getattr(event, 'sender_id', None) == _my_id:
         return
+    #дальше обрабатывают воркеры очереди, обработчик не держит событие
+    await ingest.put(event)
+
+
+async def _handle_event(event):
+    #Обработка одного события воркером очереди
+    if not ready.is_set():
+        await ready.wait()
+    stages = {} if profiler.SLOW_MESSAGE_MS > 0 else None
+    t = time.perf_counter()
     chat = await event.get_chat()
-    await _process_message(chat, event)
+    entity_index.remember(chat)
+    _lap(stages, "get_chat", t)
+    await _process_message(chat, event, stages)
+
+
+async def _load_spilled(recs):
+    #Восстанавливает выгруженные очередью на диск сообщения: один запрос на чат
+    by_chat = {}
+    for rec in recs:
+        if rec.get("chat_id") is not None and rec.get("message_id") is not None:
+            by_chat.setdefault(rec["chat_id"], []).append(rec["message_id"])
+    loaded = {}
+    for chat_id, ids in by_chat.items():
+        msgs = await client.get_messages(chat_id, ids=ids)
+        for mid, msg in zip(ids, msgs):
+            loaded[(chat_id, mid)] = msg
+    return [loaded.get((rec.get("chat_id"), rec.get("message_id"))) for rec in recs]
 
 
 async def start_client():
     #Старт Telethon-клиента
     global _my_id
+    #очередь поднимаем до подключения: события могут прийти сразу после client.start()
+    #выгруженное на диск дочитываем только после старта (клиент подключён, пул и триггеры готовы)
+    ingest.start(_handle_event, matcher=_has_match, loader=_load_spilled, ready=ready)
     await client.start()
     me = await client.get_me()
     _my_id = me.id
     print(f"Telethon client started as {_my_id}")
-    await refresh_triggers_cache()
+    #триггеры из БД загружает startup приложения параллельно с подключением
+    entity_index.start(client)
 
 
 async def stop_client():
     #Отключение
+    await ingest.stop()
+    await entity_index.stop()
     await client.disconnect()
 
 
 async def search_public(query: str, limit: int = 20):
-    #Поиск групп/каналов по названию
+    #Поиск групп/каналов по названию (с TTL-кэшем)
+    cached = entity_index.cache_get(query, limit)
+    if cached is not None:
+        return cached
     try:
         res = await client(functions.contacts.SearchRequest(q=query, limit=limit))
-        results = []
-        for c in res.chats:
-            results.append({
-                "kind": c.__class__.__name__,
-                "id": getattr(c, "id", None),
-                "username": getattr(c, "username", None),
-                "title": getattr(c, "title", None)
-            })
-        return results
     except Exception:
-        # fallback: iterate local dialogs
-        results = []
-        async for dialog in client.iter_dialogs():
-            ent = dialog.entity
-            title = getattr(ent, "title", None) or getattr(ent, "username", None) or dialog.name
-            if title and query.lower() in title.lower() and ent.__class__.__name__ != "User":
-                results.append({
-                    "kind": ent.__class__.__name__,
-                    "id": getattr(ent, "id", None),
-                    "username": getattr(ent, "username", None),
-                    "title": title
-                })
-                if len(results) >= limit:
-                    break
-        return results
+        # fallback: локальный индекс диалогов, без запросов в сеть.
+        # Не кэшируем: после FloodWait/сбоя сети следующий запрос снова пойдёт в Telegram
+        return entity_index.search_local(query, limit)
+    results = []
+    for c in res.chats:
+        entity_index.remember(c)
+        results.append({
+            "kind": c.__class__.__name__,
+            "id": getattr(c, "id", None),
+            "username": getattr(c, "username", None),
+            "title": getattr(c, "title", None)
+        })
+    entity_index.cache_put(query, limit, results)
+    return results
+
+
+async def _resolve_entity(username_or_link: str):
+    #Сначала локальный индекс, в Telegram — только если сущность ещё не встречалась
+    ent = entity_index.resolve(username_or_link)
+    if ent is None:
+        ent = await client.get_entity(username_or_link)
+        entity_index.remember(ent)
+    return ent
 
 
 async def join_by_username(username_or_link: str):
     #Вступает в канал/группу по username
     try:
-        ent = await client.get_entity(username_or_link)
+        ent = await _resolve_entity(username_or_link)
         await client(JoinChannelRequest(ent))
         return {
             "ok": True,
@@ -186,6 +309,9 @@ async def join_by_username(username_or_link: str):
             "title": getattr(ent, "title", None),
             "type": ent.__class__.__name__
         }
+    except FloodWaitError as e:
+        #Telegram просит подождать — отдаём сколько, чтобы вызывающий мог перепланировать
+        return {"ok": False, "msg": str(e), "flood_wait": e.seconds}
     except Exception as e:
         return {"ok": False, "msg": str(e)}
 
@@ -193,7 +319,7 @@ async def join_by_username(username_or_link: str):
 async def leave_by_username(username_or_link: str):
     #Выходит из канала/группы
     try:
-        ent = await client.get_entity(username_or_link)
+        ent = await _resolve_entity(username_or_link)
         await client(LeaveChannelRequest(ent))
         return {
             "ok": True,
@@ -203,5 +329,8 @@ async def leave_by_username(username_or_link: str):
             "title": getattr(ent, "title", None),
             "type": ent.__class__.__name__
         }
+    except FloodWaitError as e:
+        #Telegram просит подождать — отдаём сколько, чтобы вызывающий мог перепланировать
+        return {"ok": False, "msg": str(e), "flood_wait": e.seconds}
     except Exception as e:
-        return {"ok": False, "msg": str(e)}
\ No newline at end of file
+        return {"ok": False, "msg": str(e)}
@@ -0,0 +1,39 @@
+import uuid
+from typing import Dict
+
+#Счётчики версий данных для ETag: растут при каждой записи в соответствующую таблицу.
+#В ETag входит идентификатор запуска процесса, чтобы после рестарта старые ETag не совпадали.
+
+_boot = uuid.uuid4().hex[:8]
+_versions: Dict[str, int] = {"targets": 0, "triggers": 0, "logs": 0, "subscriptions": 0}
+
+
+def bump(name: str) -> int:
+    _versions[name] = _versions.get(name, 0) + 1
+    return _versions[name]
+
+
+def get(name: str) -> int:
+    return _versions.get(name, 0)
+
+
+def etag(name: str, *parts) -> str:
+    #Слабый ETag: версия данных + параметры запроса (limit/offset и т.п.)
+    suffix = "".join(f"-{p}" for p in parts)
+    return f'W/"{name}-{_boot}-{get(name)}{suffix}"'
+
+
+def matches(if_none_match: str, tag: str) -> bool:
+    #Сравнение по RFC 7232 (слабое): W/ не учитывается, "*" совпадает со всем
+    if not if_none_match:
+        return False
+    want = tag[2:] if tag.startswith("W/") else tag
+    for candidate in if_none_match.split(","):
+        c = candidate.strip()
+        if c == "*":
+            return True
+        if c.startswith("W/"):
+            c = c[2:]
+        if c == want:
+            return True
+    return False
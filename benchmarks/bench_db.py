@@ -0,0 +1,110 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+#Бенчмарк горячего пути записи: старые crud-функции (сессия и commit на каждый вызов)
+#против app.fastpath (asyncpg-пул, prepared statements, одна транзакция на сообщение).
+#Пишет в реальную БД: укажите BENCH_DATABASE_URL, чтобы не трогать рабочую базу.
+#Запуск из корня репозитория:
+#  python benchmarks/bench_db.py --messages 2000 --matches 2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if os.getenv("BENCH_DATABASE_URL"):
+    os.environ["DATABASE_URL"] = os.environ["BENCH_DATABASE_URL"]
+
+from app import crud, fastpath  # noqa: E402
+from app.db import init_models  # noqa: E402
+
+#tg_id таргетов бенчмарка — заведомо вне диапазона реальных чатов
+TG_ID_BASE = -9_000_000_000_000
+
+
+def _message(i: int, chats: int):
+    tgid = TG_ID_BASE - (i % chats)
+    target = {"tg_id": tgid, "username": f"bench_{i % chats}", "title": f"Bench chat {i % chats}", "type": "Channel"}
+    log = {
+        "message_id": i,
+        "author_id": 1000 + i,
+        "author_name": "bench",
+        "text": f"benchmark message {i} with some words to match",
+        "raw_json": {"id": i, "message": "benchmark"},
+    }
+    return target, log
+
+
+async def run_crud(trigger_id: int, n: int, chats: int, matches: int):
+    #Повторяет прежний _process_message: upsert + get_target_by_tg_id + create_log на каждое совпадение
+    for i in range(n):
+        target, log = _message(i, chats)
+        db_target = await crud.upsert_target_by_tgid(
+            target["tg_id"], username=target["username"], title=target["title"], typ=target["type"]
+        )
+        for _ in range(matches):
+            await crud.get_target_by_tg_id(target["tg_id"])
+            await crud.create_log({
+                "target_id": db_target.id,
+                "matched_trigger_id": trigger_id,
+                "matched_text": "words",
+                **log,
+                #asyncpg-диалект SQLAlchemy 1.4 кодирует json через str.encode — нужен готовый JSON-текст
+                "raw_json": json.dumps(log["raw_json"]),
+            })
+
+
+async def run_fastpath(trigger_id: int, n: int, chats: int, matches: int):
+    ms = [{"trigger_id": trigger_id, "trigger_target_id": None, "matched_text": "words"} for _ in range(matches)]
+    for i in range(n):
+        target, log = _message(i, chats)
+        await fastpath.save_message(target, log, ms)
+
+
+async def run_concurrent(fn, trigger_id: int, n: int, chats: int, matches: int, concurrency: int):
+    per = n // concurrency
+    await asyncio.gather(*(fn(trigger_id, per, chats, matches) for _ in range(concurrency)))
+
+
+async def cleanup(pool):
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM triggers WHERE name = 'bench'")
+        await conn.execute("DELETE FROM targets WHERE tg_id <= $1 AND tg_id > $2", TG_ID_BASE, TG_ID_BASE - 1_000_000)
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=1000)
+    ap.add_argument("--matches", type=int, default=1, help="совпадений на сообщение")
+    ap.add_argument("--chats", type=int, default=50)
+    ap.add_argument("--concurrency", type=int, default=8)
+    args = ap.parse_args()
+
+    await init_models()
+    pool = await fastpath.init_pool()
+    await cleanup(pool)
+    async with pool.acquire() as conn:
+        trigger_id = await conn.fetchval(
+            "INSERT INTO triggers (name, raw_text, pattern, flags, enabled) VALUES ('bench', 'bench', 'words', 0, FALSE) RETURNING id"
+        )
+
+    try:
+        results = []
+        for name, fn in (("crud", run_crud), ("fastpath", run_fastpath)):
+            for conc in (1, args.concurrency):
+                t0 = time.perf_counter()
+                await run_concurrent(fn, trigger_id, args.messages, args.chats, args.matches, conc)
+                dt = time.perf_counter() - t0
+                results.append((name, conc, dt, args.messages / dt))
+
+        print(f"messages={args.messages} matches/msg={args.matches} chats={args.chats}")
+        print(f"{'impl':<10}{'conc':>6}{'seconds':>10}{'msg/s':>10}")
+        for name, conc, dt, rate in results:
+            print(f"{name:<10}{conc:>6}{dt:>10.2f}{rate:>10.0f}")
+    finally:
+        await cleanup(pool)
+        await fastpath.close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
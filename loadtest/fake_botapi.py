@@ -0,0 +1,118 @@
+import re
+import math
+import time
+import asyncio
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Set
+from urllib.parse import parse_qs
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from loadtest import fake_feed
+
+#Заглушка Telegram Bot API с лимитами, похожими на настоящие:
+#  не больше PER_CHAT_PER_SEC сообщений в секунду в один чат,
+#  не больше GROUP_PER_MIN в минуту в группу (chat_id < 0),
+#  не больше GLOBAL_PER_SEC в секунду на бота.
+#Превышение — 429 с retry_after, как у Telegram. Доставленные сообщения разбираются по маркеру lt:<id>.
+
+PER_CHAT_PER_SEC = 1
+GROUP_PER_MIN = 20
+GLOBAL_PER_SEC = 30
+
+app = FastAPI(title="fake bot api")
+
+_LT_RE = re.compile(r"lt:(\d+)")
+
+_global: Deque[float] = deque()
+_per_chat: Dict[int, Deque[float]] = defaultdict(deque)
+_per_group: Dict[int, Deque[float]] = defaultdict(deque)
+_message_id = 0
+
+#результаты для отчёта
+delivered: Dict[int, Set[int]] = defaultdict(set)
+lags: List[float] = []
+stats: Dict[str, int] = {"sent": 0, "rejected_429": 0, "duplicates": 0}
+send_times: List[float] = []
+
+
+def _retry_after(window: Deque[float], limit: int, period: float, now: float) -> float:
+    #Сколько ждать, пока в скользящем окне освободится место (0 — можно слать)
+    while window and window[0] <= now - period:
+        window.popleft()
+    if len(window) < limit:
+        return 0.0
+    return window[0] + period - now
+
+
+def _too_many(retry_after: float) -> JSONResponse:
+    stats["rejected_429"] += 1
+    secs = max(1, math.ceil(retry_after))
+    return JSONResponse(status_code=429, content={
+        "ok": False,
+        "error_code": 429,
+        "description": f"Too Many Requests: retry after {secs}",
+        "parameters": {"retry_after": secs},
+    })
+
+
+async def _params(request: Request) -> Dict[str, Any]:
+    ctype = request.headers.get("content-type", "")
+    if ctype.startswith("multipart/"):
+        form = await request.form()
+        return dict(form)
+    if ctype.startswith("application/json"):
+        return await request.json()
+    body = (await request.body()).decode("utf-8")
+    return {k: v[-1] for k, v in parse_qs(body).items()}
+
+
+def _send_message(params: Dict[str, Any]) -> JSONResponse:
+    global _message_id
+    now = time.time()
+    chat_id = int(params.get("chat_id"))
+    wait = max(
+        _retry_after(_global, GLOBAL_PER_SEC, 1.0, now),
+        _retry_after(_per_chat[chat_id], PER_CHAT_PER_SEC, 1.0, now),
+        _retry_after(_per_group[chat_id], GROUP_PER_MIN, 60.0, now) if chat_id < 0 else 0.0,
+    )
+    if wait > 0:
+        return _too_many(wait)
+    _global.append(now)
+    _per_chat[chat_id].append(now)
+    if chat_id < 0:
+        _per_group[chat_id].append(now)
+
+    text = params.get("text") or ""
+    m = _LT_RE.search(text)
+    if m:
+        lid = int(m.group(1))
+        if lid in delivered[chat_id]:
+            stats["duplicates"] += 1
+        delivered[chat_id].add(lid)
+        born = fake_feed.created.get(lid)
+        if born is not None:
+            lags.append(now - born)
+    stats["sent"] += 1
+    send_times.append(now)
+    _message_id += 1
+    return JSONResponse({"ok": True, "result": {
+        "message_id": _message_id,
+        "date": int(now),
+        "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"},
+        "text": text,
+    }})
+
+
+@app.post("/bot{token}/{method}")
+async def bot_method(token: str, method: str, request: Request):
+    params = await _params(request)
+    if method == "sendMessage":
+        return _send_message(params)
+    if method == "getMe":
+        return {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot"}}
+    if method == "getUpdates":
+        await asyncio.sleep(min(float(params.get("timeout") or 0), 5))
+        return {"ok": True, "result": []}
+    if method in ("deleteWebhook", "close", "logOut"):
+        return {"ok": True, "result": True}
+    return JSONResponse(status_code=404, content={"ok": False, "error_code": 404, "description": "Not Found: method not found"})
@@ -0,0 +1,113 @@
+import json
+import time
+import random
+import asyncio
+from typing import Dict, List, Optional
+from fastapi import FastAPI, Request, Response
+
+#Заглушка FastAPI-ленты для нагрузочного прогона репостера: генерирует логи с заданной частотой
+#и отдаёт их по тем же маршрутам, что и app.main (/feed, /targets, /subscriptions).
+#В текст каждого лога вшит маркер lt:<id>, по нему fake_botapi считает задержку доставки.
+
+app = FastAPI(title="fake feed")
+
+#id идут подряд с 1, поэтому лог с id N лежит в _logs[N - 1]
+_logs: List[Dict] = []
+#id лога -> time.time() создания (для подсчёта задержки и потерь)
+created: Dict[int, float] = {}
+_next_id = 1
+_targets = [
+    {"id": i, "tg_id": 1000 + i, "username": f"loadtest_{i}", "title": f"Load test chat {i}", "type": "Channel"}
+    for i in range(1, 6)
+]
+_generator: Optional[asyncio.Task] = None
+
+
+def _make_log() -> Dict:
+    global _next_id
+    lid = _next_id
+    _next_id += 1
+    now = time.time()
+    created[lid] = now
+    tgt = random.choice(_targets)
+    return {
+        "id": lid,
+        "target_id": tgt["id"],
+        "target_title": tgt["title"],
+        "target_username": tgt["username"],
+        "message_id": lid,
+        "author_id": random.randint(1, 10_000),
+        "author_name": "loadtest",
+        "text": f"lt:{lid} " + "нагрузочное сообщение " * random.randint(1, 20),
+        "matched_trigger_id": 1,
+        "matched_text": "нагрузочное",
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now)),
+    }
+
+
+async def _generate(rate: float):
+    #Равномерный поток rate логов/сек (пачками, чтобы не зависеть от точности sleep)
+    tick = 0.05
+    carry = 0.0
+    while True:
+        carry += rate * tick
+        n = int(carry)
+        carry -= n
+        for _ in range(n):
+            _logs.append(_make_log())
+        await asyncio.sleep(tick)
+
+
+def start(rate: float):
+    global _generator
+    _generator = asyncio.create_task(_generate(rate))
+
+
+def stop():
+    if _generator is not None:
+        _generator.cancel()
+
+
+def last_id() -> int:
+    return _next_id - 1
+
+
+def _etag(*parts) -> str:
+    return 'W/"' + "-".join(str(p) for p in (last_id(),) + parts) + '"'
+
+
+@app.get("/feed")
+async def feed(request: Request, limit: int = 50, offset: int = 0, since_id: Optional[int] = None):
+    tag = _etag(limit, offset, since_id)
+    if request.headers.get("if-none-match") == tag:
+        return Response(status_code=304, headers={"ETag": tag})
+    if since_id is not None:
+        start = max(0, since_id)
+        out = _logs[start:start + limit]
+    else:
+        end = max(0, len(_logs) - offset)
+        out = _logs[max(0, end - limit):end][::-1]
+    return Response(content=_json(out), media_type="application/json", headers={"ETag": tag})
+
+
+@app.get("/targets")
+async def targets(request: Request):
+    tag = 'W/"targets-1"'
+    if request.headers.get("if-none-match") == tag:
+        return Response(status_code=304, headers={"ETag": tag})
+    return Response(content=_json(_targets), media_type="application/json", headers={"ETag": tag})
+
+
+@app.get("/subscriptions")
+async def subscriptions():
+    return []
+
+
+@app.get("/triggers")
+async def triggers():
+    return [{"id": 1, "name": "loadtest", "raw_text": "нагрузочное", "pattern": "нагрузочное",
+             "flags": 0, "target_id": None, "enabled": True}]
+
+
+def _json(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from typing import List
+
+#Сквозной нагрузочный прогон репостера без сети:
+#  fake_feed (генератор логов) -> reposter_bot.poller -> format_log_message -> bot.send_message -> fake_botapi (лимиты, 429)
+#Отчёт: задержка доставки (от создания лога до приёма заглушкой Bot API), отправок в секунду, потери, число 429.
+#Запуск из корня репозитория:
+#  python -m loadtest.run --rate 20 --duration 60 --chats 5
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn  # noqa: E402
+from aiogram import Bot  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+import reposter_bot  # noqa: E402
+from loadtest import fake_feed, fake_botapi  # noqa: E402
+
+
+async def serve(app, port: int):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    s = sorted(values)
+    k = min(len(s) - 1, max(0, int(round(p / 100 * (len(s) - 1)))))
+    return s[k]
+
+
+def report(chats: List[int], generated: int, elapsed: float):
+    delivered = {c: len(fake_botapi.delivered.get(c, ())) for c in chats}
+    expected = generated * len(chats)
+    got = sum(delivered.values())
+    lags = fake_botapi.lags
+    sends = fake_botapi.send_times
+    span = (sends[-1] - sends[0]) if len(sends) > 1 else 0.0
+    print()
+    print(f"generated logs      : {generated} за {elapsed:.1f} с ({generated / elapsed:.1f}/с)")
+    print(f"chats               : {len(chats)}")
+    print(f"delivered           : {got} из {expected}")
+    print(f"lost                : {expected - got} ({(expected - got) / expected * 100 if expected else 0:.2f}%)")
+    print(f"duplicates          : {fake_botapi.stats['duplicates']}")
+    print(f"429 responses       : {fake_botapi.stats['rejected_429']}")
+    print(f"sends/s             : {len(sends) / span if span else 0:.2f}")
+    print(f"lag p50/p95/p99/max : {percentile(lags, 50):.2f} / {percentile(lags, 95):.2f} / "
+          f"{percentile(lags, 99):.2f} / {max(lags) if lags else float('nan'):.2f} с")
+    for c in chats:
+        print(f"  chat {c}: {delivered[c]}/{generated}")
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rate", type=float, default=10, help="логов в секунду")
+    ap.add_argument("--duration", type=float, default=30, help="сколько секунд генерировать логи")
+    ap.add_argument("--chats", type=int, default=3, help="подписанных чатов")
+    ap.add_argument("--groups", action="store_true", help="чаты — группы (лимит 20 сообщений в минуту)")
+    ap.add_argument("--poll-interval", type=float, default=1)
+    ap.add_argument("--drain", type=float, default=60, help="сколько ждать дочитывания после остановки генератора")
+    ap.add_argument("--feed-port", type=int, default=18000)
+    ap.add_argument("--bot-port", type=int, default=18081)
+    args = ap.parse_args()
+
+    feed_server, feed_task = await serve(fake_feed.app, args.feed_port)
+    bot_server, bot_task = await serve(fake_botapi.app, args.bot_port)
+
+    sign = -1 if args.groups else 1
+    chats = [sign * (100 + i) for i in range(args.chats)]
+    state_dir = tempfile.mkdtemp(prefix="reposter-loadtest-")
+    state_path = os.path.join(state_dir, "state.json")
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump({"last_seen_id": 0, "chats": chats}, f)
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{args.bot_port}"))
+    bot = Bot(token="123456:LOADTEST", session=session, default=DefaultBotProperties(parse_mode="HTML"))
+
+    started = time.time()
+    fake_feed.start(args.rate)
+    poll_task = asyncio.create_task(
+        reposter_bot.poller(bot, f"http://127.0.0.1:{args.feed_port}", state_path, args.poll_interval, True)
+    )
+    await asyncio.sleep(args.duration)
+    fake_feed.stop()
+    elapsed = time.time() - started
+    generated = fake_feed.last_id()
+
+    #ждём, пока репостер дошлёт хвост (или истечёт --drain)
+    deadline = time.time() + args.drain
+    while time.time() < deadline:
+        if all(len(fake_botapi.delivered.get(c, ())) >= generated for c in chats):
+            break
+        await asyncio.sleep(0.5)
+
+    poll_task.cancel()
+    await bot.session.close()
+    report(chats, generated, elapsed)
+
+    feed_server.should_exit = True
+    bot_server.should_exit = True
+    await asyncio.gather(feed_task, bot_task, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,19 +1,38 @@
 import os
+import time
+import signal
 import asyncio
 import json
 import html as html_lib
-from typing import Dict, Any, List, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Tuple
 from dotenv import load_dotenv
 import httpx
 from aiogram import Bot, Dispatcher
 from aiogram.types import Message
 from aiogram.filters import Command
 from aiogram.client.default import DefaultBotProperties
+from aiogram.exceptions import TelegramRetryAfter
+import reposter_cluster as cluster
+from app import profiler
 
 
 STATE_PATH_DEFAULT = "reposter_state.json"
 load_dotenv()
 
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "5"))
+#kill -USR1 <pid> снимает профиль на PROFILE_SECONDS и пишет его в PROFILE_DIR
+PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", "30"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", ".")
+#сколько ждать готовности API (/readyz) перед стартом поллера, сек
+API_READY_TIMEOUT = float(os.getenv("API_READY_TIMEOUT", "60"))
+
+#Кэш условных GET: url без параметров -> (url с параметрами, ETag, разобранный JSON).
+#Одна запись на путь: новый курсор (since_id) заменяет прошлую страницу, а не копится рядом
+_http_cache: Dict[str, Tuple[str, str, Any]] = {}
+#Карта таргетов, построенная для конкретного ETag /targets
+_targets_map_cache: Tuple[Optional[str], Dict[int, Dict[str, Any]]] = (None, {})
+
 #Загружает состояние бота из файла json
 def load_state(path: str) -> Dict[str, Any]:
     if os.path.exists(path):
@@ -59,6 +78,8 @@ def format_log_message(log: Dict[str, Any], targets_map: Dict[int, Dict[str, Any
     if matched_trigger:
         parts.append(f"<b>Совпадение триггера:</b> {esc(matched_trigger)}")
         parts.append(f"<b>Найденный текст:</b> {esc(matched_text)}")
+    if log.get("duplicate"):
+        parts.append("<i>Повтор: этот текст уже приходил из другого чата</i>")
     parts.append("")  # blank
     # body as preformatted (safe)
     parts.append("<pre>{}</pre>".format(esc(text)[:3900]))
@@ -69,22 +90,139 @@ def format_log_message(log: Dict[str, Any], targets_map: Dict[int, Dict[str, Any
 
     return "\n".join(parts)
 
+#GET с If-None-Match: на 304 возвращает ранее разобранный ответ, не скачивая и не парся тело заново.
+#Возвращает (status_code, data, etag); для 304 status_code тоже 304, data — из кэша
+async def cached_get_json(client: httpx.AsyncClient, url: str, params: Optional[Dict[str, Any]] = None):
+    key = str(httpx.URL(url, params=params))
+    hit = _http_cache.get(url)
+    if hit and hit[0] != key:
+        hit = None
+    headers = {"If-None-Match": hit[1]} if hit else {}
+    r = await client.get(key, headers=headers)
+    if r.status_code == 304 and hit:
+        return 304, hit[2], hit[1]
+    if r.status_code != 200:
+        return r.status_code, None, None
+    data = r.json()
+    etag = r.headers.get("etag")
+    if etag:
+        _http_cache[url] = (key, etag, data)
+    else:
+        _http_cache.pop(url, None)
+    return 200, data, etag
+
 #Получает из фастапи все таргеты и превращает в id для быстрого доступа
 async def fetch_targets_map(client: httpx.AsyncClient, api_base: str) -> Dict[int, Dict[str, Any]]:
+    global _targets_map_cache
     try:
-        r = await client.get(f"{api_base.rstrip('/')}/targets")
-        if r.status_code == 200:
-            arr = r.json()
+        status, arr, etag = await cached_get_json(client, f"{api_base.rstrip('/')}/targets")
+        if status in (200, 304):
+            if etag and etag == _targets_map_cache[0]:
+                return _targets_map_cache[1]
             m = {}
             for t in arr:
                 if t.get("id") is not None:
                     m[int(t["id"])] = t
+            _targets_map_cache = (etag, m)
             return m
     except Exception:
         pass
-    return {}
+    return _targets_map_cache[1]
 
 
+#Отправка одного сообщения в чат. На 429 ждём retry_after и повторяем,
+#остальные ошибки только логируются, как и раньше
+async def send_to_chat(bot: Bot, chat: int, msg: str) -> bool:
+    for attempt in range(SEND_MAX_RETRIES + 1):
+        try:
+            await bot.send_message(chat, msg, disable_web_page_preview=True)
+            return True
+        except TelegramRetryAfter as e:
+            if attempt == SEND_MAX_RETRIES:
+                print(f"Failed send to {chat}: {e}")
+                return False
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            print(f"Failed send to {chat}: {e}")
+            return False
+    return False
+
+#Оставляет логи, которые нужно репостить: есть совпадение и автор — не сам бот
+def deliverable(logs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    bot_author_id = int(os.getenv("BOT_AUTHOR_ID", "7124862056"))
+    return [
+        l for l in logs
+        if l.get("matched_trigger_id") and l.get("author_id") != bot_author_id
+    ]
+
+#id самого свежего лога (для старта без backfill)
+async def fetch_latest_log_id(client: httpx.AsyncClient, api_base: str) -> int:
+    r = await client.get(f"{api_base.rstrip('/')}/feed", params={"limit": 1})
+    if r.status_code == 200:
+        arr = r.json() or []
+        if arr:
+            return int(arr[0].get("id") or 0)
+    return 0
+
+#Ждёт /readyz API: иначе начальный курсор не прочитать и поллер начнёт с пустой ленты.
+#По таймауту стартуем всё равно — поллер переживает недоступность API
+async def wait_api_ready(api_base: str, timeout: float = API_READY_TIMEOUT) -> bool:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=5.0) as client:
+        while True:
+            try:
+                r = await client.get(f"{api_base.rstrip('/')}/readyz")
+                if r.status_code == 200:
+                    return True
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() >= deadline:
+                print("Reposter: API not ready after", timeout, "s, starting anyway")
+                return False
+            await asyncio.sleep(1)
+
+#Чаты с серверными фильтрами: chat_id -> фильтры (через ETag-кэш, обычно 304).
+#None — список не получен (например, 503 при рестарте API): доставку в этом цикле пропускаем,
+#иначе чаты с фильтрами получили бы всю общую ленту
+async def fetch_subscriptions(client: httpx.AsyncClient, api_base: str) -> Optional[Dict[int, Dict[str, Any]]]:
+    status, arr, _ = await cached_get_json(client, f"{api_base.rstrip('/')}/subscriptions")
+    if status not in (200, 304) or not isinstance(arr, list):
+        print("Reposter: subscriptions request failed, status:", status)
+        return None
+    return {int(s["chat_id"]): s for s in arr}
+
+#Доставляет в чат его отфильтрованную сервером ленту начиная с cursor, возвращает новый курсор.
+#В _http_cache остаётся только последняя страница чата (запись на путь), а не страница на каждый курсор
+async def deliver_subscription(bot: Bot, client: httpx.AsyncClient, api_base: str, chat: int, cursor: int,
+                               page: int = 100) -> int:
+    status, data, _ = await cached_get_json(
+        client, f"{api_base.rstrip('/')}/subscriptions/{chat}/feed", {"since_id": cursor, "limit": page}
+    )
+    if status != 200 or not isinstance(data, list) or not data:
+        return cursor
+    logs = deliverable(data)
+    if logs:
+        targets_map = await fetch_targets_map(client, api_base)
+        for log in logs:
+            await send_to_chat(bot, chat, format_log_message(log, targets_map))
+    return max(cursor, max(int(l.get("id", 0)) for l in data))
+
+#Разбор фильтров команды /subscribe: trigger=1,2 target=5 author=123
+def parse_filters(args: List[str]) -> Optional[Dict[str, List[int]]]:
+    keys = {"trigger": "trigger_ids", "target": "target_ids", "author": "author_ids"}
+    out: Dict[str, List[int]] = {}
+    for a in args:
+        if "=" not in a:
+            return None
+        k, v = a.split("=", 1)
+        if k not in keys:
+            return None
+        try:
+            out[keys[k]] = [int(x) for x in v.split(",") if x]
+        except ValueError:
+            return None
+    return out
+
 async def poller(bot: Bot, api_base: str, state_path: str, poll_interval: int, backfill: bool):
     state = load_state(state_path)
     last_seen = int(state.get("last_seen_id", 0))
@@ -93,37 +231,36 @@ async def poller(bot: Bot, api_base: str, state_path: str, poll_interval: int, b
     async with httpx.AsyncClient(timeout=10.0) as client:
         if last_seen == 0 and not backfill:
             try:
-                r = await client.get(f"{api_base.rstrip('/')}/feed?limit=1")
-                if r.status_code == 200:
-                    arr = r.json() or []
-                    if len(arr) > 0:
-                        last_seen = int(arr[0].get("id") or 0)
-                        state["last_seen_id"] = last_seen
-                        save_state(state_path, state)
-                        print("Reposter: initialized last_seen to", last_seen)
+                last_seen = await fetch_latest_log_id(client, api_base)
+                if last_seen:
+                    state["last_seen_id"] = last_seen
+                    save_state(state_path, state)
+                    print("Reposter: initialized last_seen to", last_seen)
             except Exception as e:
                 print("Reposter: init fetch failed:", e)
 
     while True:
         try:
             async with httpx.AsyncClient(timeout=20.0) as client:
-                r = await client.get(f"{api_base.rstrip('/')}/feed?limit=50")
-                if r.status_code == 200:
-                    logs: List[Dict[str, Any]] = r.json() or []
+                feed_url = f"{api_base.rstrip('/')}/feed"
+                status, data, _ = await cached_get_json(client, feed_url, {"limit": 50})
+                if status == 304:
+                    #лента не менялась с прошлого опроса
+                    pass
+                elif status == 200:
+                    logs: List[Dict[str, Any]] = data or []
                     if not isinstance(logs, list):
                         logs = []
-                    new_logs = [
-                        l for l in logs
-                        if int(l.get("id", 0)) > last_seen
-                        and l.get("matched_trigger_id")
-                    ]
-
-                    BOT_AUTHOR_ID = int(os.getenv("BOT_AUTHOR_ID", "7124862056"))
-                    new_logs = [l for l in new_logs if l.get("author_id") != BOT_AUTHOR_ID]
+                    new_logs = [l for l in deliverable(logs) if int(l.get("id", 0)) > last_seen]
 
                     if new_logs:
                         new_logs.sort(key=lambda x: int(x.get("id", 0)))
                         targets_map = await fetch_targets_map(client, api_base)
+                        filtered = await fetch_subscriptions(client, api_base)
+                        if filtered is None:
+                            #повторим на следующем опросе: без кэша /feed ответит 200, а не 304
+                            _http_cache.pop(feed_url, None)
+                            new_logs = []
                         for log in new_logs:
 
                             msg = format_log_message(log, targets_map)
@@ -131,30 +268,100 @@ async def poller(bot: Bot, api_base: str, state_path: str, poll_interval: int, b
                             state = load_state(state_path)
                             chats: List[int] = state.get("chats", [])
                             for chat in chats:
-                                try:
-                                    await bot.send_message(chat, msg, disable_web_page_preview=True)
-                                except Exception as e:
-                                    print(f"Failed send to {chat}: {e}")
+                                if chat not in filtered:
+                                    await send_to_chat(bot, chat, msg)
                             last_seen = max(last_seen, int(log.get("id", 0)))
                             state["last_seen_id"] = last_seen
                             save_state(state_path, state)
                 else:
-                    print("Reposter: feed request failed, status:", r.status_code)
+                    print("Reposter: feed request failed, status:", status)
+
+                #чаты с фильтрами получают свою ленту от сервера, каждый со своим курсором
+                state = load_state(state_path)
+                filtered = await fetch_subscriptions(client, api_base)
+                cursors: Dict[str, int] = state.setdefault("cursors", {})
+                changed = False
+                for chat in state.get("chats", []) if filtered is not None else []:
+                    if chat not in filtered:
+                        continue
+                    cur = int(cursors.get(str(chat), last_seen))
+                    new_cur = await deliver_subscription(bot, client, api_base, chat, cur)
+                    if new_cur != cur or str(chat) not in cursors:
+                        cursors[str(chat)] = new_cur
+                        changed = True
+                if changed:
+                    save_state(state_path, state)
         except Exception as e:
             print("Reposter poller error:", e)
 
         await asyncio.sleep(poll_interval)
 
+#Поллер кластерного режима: доставляет только в чаты, арендованные этим экземпляром,
+#читая ленту от минимального курсора среди них
+async def cluster_poller(bot: Bot, api_base: str, poll_interval: int, page: int = 100):
+    print("Reposter: starting cluster poller, instance =", cluster.INSTANCE_ID)
+    async with httpx.AsyncClient(timeout=20.0) as client:
+        while True:
+            full_page = False
+            try:
+                owned = cluster.owned_chats()
+                filtered = await fetch_subscriptions(client, api_base) if owned else {}
+                if filtered is None:
+                    #без списка подписок не знаем, кому какая лента положена
+                    owned = {}
+                for chat, cur in owned.items():
+                    if chat in filtered:
+                        new_cur = await deliver_subscription(bot, client, api_base, chat, cur, page)
+                        if new_cur > cur:
+                            await cluster.advance(chat, new_cur)
+                #остальные чаты получают общую ленту
+                chats = {c: cur for c, cur in owned.items() if c not in filtered}
+                if chats:
+                    since = min(chats.values())
+                    status, data, _ = await cached_get_json(
+                        client, f"{api_base.rstrip('/')}/feed", {"since_id": since, "limit": page}
+                    )
+                    if status == 200 and isinstance(data, list) and data:
+                        full_page = len(data) >= page
+                        page_max = max(int(l.get("id", 0)) for l in data)
+                        logs = deliverable(data)
+                        targets_map = await fetch_targets_map(client, api_base) if logs else {}
+                        lost = set()
+                        for log in logs:
+                            lid = int(log.get("id", 0))
+                            msg = None
+                            for chat, cur in chats.items():
+                                if chat in lost or lid <= cur:
+                                    continue
+                                if msg is None:
+                                    msg = format_log_message(log, targets_map)
+                                await send_to_chat(bot, chat, msg)
+                                if await cluster.advance(chat, lid):
+                                    chats[chat] = lid
+                                else:
+                                    lost.add(chat)
+                        #пропущенные логи (без совпадения, от самого бота) тоже сдвигают курсор
+                        for chat, cur in chats.items():
+                            if chat not in lost and cur < page_max:
+                                await cluster.advance(chat, page_max)
+                    elif status not in (200, 304):
+                        print("Reposter: feed request failed, status:", status)
+            except Exception as e:
+                print("Reposter cluster poller error:", e)
+            #полная страница — сразу читаем следующую, иначе ждём
+            if not full_page:
+                await asyncio.sleep(poll_interval)
+
 FASTAPI_URL = os.getenv("FASTAPI_URL")
 
 #Регистрирует обработчики команд бота
-def register_handlers(dp: Dispatcher, state_path: str, api_url: str):
+def register_handlers(dp: Dispatcher, state_path: str, api_url: str, cluster_mode: bool = False, backfill: bool = False):
     @dp.message(Command(commands=["start"]))
     async def cmd_start(message: Message):
         text = (
             "Я — репостер ленты `/feed` FastAPI. Команды:\n"
             "\nДля показа ленты с названием группы/канала, автором и текстом сообщения:\n"
-            "/subscribe — подписать этот чат на репосты\n"
+            "/subscribe [trigger=id,id] [target=id] [author=id] — подписать этот чат на репосты (с фильтрами)\n"
             "/unsubscribe — отписать этот чат\n"
             "/status — показать статус\n"
             "\nДля поиска канала по названию:\n"
@@ -164,40 +371,88 @@ def register_handlers(dp: Dispatcher, state_path: str, api_url: str):
             "/addtrigger &lt;слова&gt — Для добавления триггера на сообщения\n"
             "/updatetrigger &lt;id&gt &lt;слова&gt — Для обновления триггера\n "
             "/deletetrigger &lt;id&gt — Для удаления триггера\n "
+            "/backtest [дней] &lt;слова&gt; — проверить триггер на истории до добавления\n"
             "\nДля добавления и выхода из группы/канала: \n "
             "/join &lt;@username&gt; — добавить userbot в канал/группу\n"
             "/leave &lt;@username&gt; — выйти из канала/группы\n"
+            "/bulkjoin &lt;@a @b ...&gt; — вступить в список каналов фоновым заданием\n"
+            "/job &lt;id&gt; — прогресс задания\n"
+            "/stats [дней] — самые частые срабатывания триггеров\n"
         )
         await message.answer(text)
 
     @dp.message(Command(commands=["subscribe"]))
     async def cmd_subscribe(message: Message):
-        st = load_state(state_path)
-        chats = st.get("chats", [])
         cid = message.chat.id
-        if cid in chats:
-            await message.reply("Этот чат уже подписан.")
+        #необязательные фильтры хранятся на сервере: /subscribe trigger=1,2 target=5 author=123
+        filters = parse_filters(message.text.split()[1:])
+        if filters is None:
+            await message.reply("Использование: /subscribe [trigger=id,id] [target=id,id] [author=id,id]")
             return
-        chats.append(cid)
-        st["chats"] = chats
-        save_state(state_path, st)
-        await message.reply("Готово — этот чат подписан на репосты.")
+        if filters:
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                r = await client.put(f"{api_url.rstrip('/')}/subscriptions/{cid}", json=filters)
+            if r.status_code != 200:
+                await message.reply(f"Ошибка сохранения фильтров: {r.status_code} {r.text}")
+                return
+        if cluster_mode:
+            cursor = 0
+            if not backfill:
+                async with httpx.AsyncClient(timeout=10.0) as client:
+                    cursor = await fetch_latest_log_id(client, api_url)
+            added = await cluster.subscribe(cid, cursor)
+        else:
+            st = load_state(state_path)
+            chats = st.get("chats", [])
+            added = cid not in chats
+            if added:
+                chats.append(cid)
+                st["chats"] = chats
+                save_state(state_path, st)
+        if added:
+            await message.reply("Готово — этот чат подписан на репосты." + (" Фильтры сохранены." if filters else ""))
+        elif filters:
+            await message.reply("Фильтры подписки обновлены.")
+        else:
+            await message.reply("Этот чат уже подписан.")
 
     @dp.message(Command(commands=["unsubscribe"]))
     async def cmd_unsubscribe(message: Message):
+        cid = message.chat.id
+        try:
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                await client.delete(f"{api_url.rstrip('/')}/subscriptions/{cid}")
+        except Exception as e:
+            print("Failed to delete subscription filters:", e)
+        if cluster_mode:
+            if await cluster.unsubscribe(cid):
+                await message.reply("Готово — этот чат отписан.")
+            else:
+                await message.reply("Этот чат не был подписан.")
+            return
         st = load_state(state_path)
         chats = st.get("chats", [])
-        cid = message.chat.id
         if cid not in chats:
             await message.reply("Этот чат не был подписан.")
             return
         chats = [c for c in chats if c != cid]
         st["chats"] = chats
+        st.get("cursors", {}).pop(str(cid), None)
         save_state(state_path, st)
         await message.reply("Готово — этот чат отписан.")
 
     @dp.message(Command(commands=["status"]))
     async def cmd_status(message: Message):
+        if cluster_mode:
+            row = await cluster.chat_status(message.chat.id)
+            if row is None:
+                await message.reply(f"instance = {cluster.INSTANCE_ID}\nэтот чат не подписан")
+            else:
+                await message.reply(
+                    f"instance = {cluster.INSTANCE_ID}\ncursor = {row['cursor']}\n"
+                    f"owner = {row['owner']}\nlease_until = {row['lease_until']}"
+                )
+            return
         st = load_state(state_path)
         last = st.get("last_seen_id", 0)
         chats = st.get("chats", [])
@@ -246,9 +501,8 @@ def register_handlers(dp: Dispatcher, state_path: str, api_url: str):
     @dp.message(Command("listtriggers"))
     async def cmd_listtriggers(message: Message):
         async with httpx.AsyncClient(timeout=10.0) as client:
-            r = await client.get(f"{api_url.rstrip('/')}/triggers")
-            if r.status_code == 200:
-                arr = r.json()
+            status, arr, _ = await cached_get_json(client, f"{api_url.rstrip('/')}/triggers")
+            if status in (200, 304):
                 if not arr:
                     await message.reply("Триггеров нет")
                 else:
@@ -262,7 +516,7 @@ def register_handlers(dp: Dispatcher, state_path: str, api_url: str):
                         )
                     await message.reply("\n\n".join(lines))
             else:
-                await message.reply(f"Ошибка: {r.status_code} {r.text}")
+                await message.reply(f"Ошибка: {status}")
 
     @dp.message(Command("addtrigger"))
     async def cmd_addtrigger(message: Message):
@@ -335,6 +589,158 @@ def register_handlers(dp: Dispatcher, state_path: str, api_url: str):
             else:
                 await message.reply(f"Ошибка leave: {r.status_code} {r.text}")
 
+    @dp.message(Command(commands=["bulkjoin"]))
+    async def cmd_bulkjoin(message: Message):
+        args = message.text.split(maxsplit=1)
+        if len(args) < 2:
+            await message.reply("Использование: /bulkjoin <@username или ссылка> ... (через пробел, запятую или с новой строки)")
+            return
+        usernames = [u for u in args[1].replace(",", " ").split() if u]
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            r = await client.post(f"{api_url.rstrip('/')}/jobs/join", json={"usernames": usernames})
+            if r.status_code == 200:
+                job = r.json()
+                await message.reply(
+                    f"Задание {job['id']} создано: {job['total']} каналов, "
+                    f"~{int(job.get('eta_seconds') or 0)} сек. Прогресс: /job {job['id']}"
+                )
+            else:
+                await message.reply(f"Ошибка bulkjoin: {r.status_code} {r.text}")
+
+    @dp.message(Command(commands=["job"]))
+    async def cmd_job(message: Message):
+        args = message.text.split(maxsplit=1)
+        if len(args) < 2:
+            await message.reply("Использование: /job <id>")
+            return
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            r = await client.get(f"{api_url.rstrip('/')}/jobs/{args[1].strip()}")
+            if r.status_code == 200:
+                job = r.json()
+                failed = [i for i in job.get("items") or [] if i["status"] == "failed"]
+                lines = [
+                    f"Задание {job['id']} ({job['action']}): {job['status']}",
+                    f"готово {job['done']}/{job['total']}, ошибок {job['failed']}, осталось ~{int(job.get('eta_seconds') or 0)} сек."
+                ]
+                for i in failed[:10]:
+                    lines.append(f"{esc(i['username'])}: {esc(i.get('msg'))}")
+                await message.reply("\n".join(lines))
+            else:
+                await message.reply(f"Ошибка: {r.status_code} {r.text}")
+
+    @dp.message(Command(commands=["stats"]))
+    async def cmd_stats(message: Message):
+        args = message.text.split(maxsplit=1)
+        try:
+            days = int(args[1]) if len(args) > 1 else 7
+        except ValueError:
+            await message.reply("Использование: /stats [число дней]")
+            return
+        since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            r = await client.get(f"{api_url.rstrip('/')}/stats/top", params={"period": "day", "since": since, "limit": 15})
+            if r.status_code != 200:
+                await message.reply(f"Ошибка: {r.status_code} {r.text}")
+                return
+            rows = r.json()
+            if not rows:
+                await message.reply(f"За {days} дн. срабатываний нет.")
+                return
+            targets_map = await fetch_targets_map(client, api_url)
+            status, triggers, _ = await cached_get_json(client, f"{api_url.rstrip('/')}/triggers")
+            names = {t["id"]: t.get("raw_text") or t.get("pattern") for t in (triggers or [])}
+            lines = [f"<b>Срабатывания за {days} дн.:</b>"]
+            for row in rows:
+                tgt = targets_map.get(row.get("target_id")) or {}
+                where = tgt.get("title") or tgt.get("username") or ("без чата" if row.get("target_id") is None else row.get("target_id"))
+                lines.append(f"#{row['trigger_id']} {esc(names.get(row['trigger_id']))} — {esc(where)}: {row['hits']}")
+            await message.reply("\n".join(lines))
+
+    @dp.message(Command(commands=["backtest"]))
+    async def cmd_backtest(message: Message):
+        #/backtest [дней] <паттерн> — сколько сработал бы триггер на истории
+        args = message.text.split(maxsplit=2)
+        if len(args) < 2:
+            await message.reply("Использование: /backtest [дней] <регулярное выражение>")
+            return
+        days = 30
+        user_pattern = " ".join(args[1:])
+        if len(args) == 3 and args[1].isdigit():
+            days = int(args[1])
+            user_pattern = args[2]
+        async with httpx.AsyncClient(timeout=300.0) as client:
+            r = await client.post(f"{api_url.rstrip('/')}/triggers/backtest", json={"pattern": user_pattern, "days": days})
+            if r.status_code != 200:
+                await message.reply(f"Ошибка: {r.status_code} {esc(r.text)}")
+                return
+            res = r.json()
+        lines = [
+            f"<b>Бэктест</b> {esc(user_pattern)} за {days} дн.:",
+            f"сообщений {res['messages']}, совпало {res['hit_messages']} ({res['hit_ratio'] * 100:.2f}%)",
+            f"≈ {res.get('est_hits_per_day') or 0} в день, {res.get('cost_us_per_message') or 0} мкс на сообщение",
+        ]
+        for smp in res.get("samples", [])[:5]:
+            lines.append(f"• <b>{esc(smp['matched_text'])}</b>: {esc(smp['text'][:150])}")
+        await message.reply("\n".join(lines))
+
+async def dump_profile(seconds: float):
+    folded = await profiler.profile(seconds)
+    path = os.path.join(PROFILE_DIR, f"reposter-profile-{int(time.time())}.folded")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(folded)
+    print("Reposter: profile written to", path)
+
+#Обработчик SIGUSR1: профиль по запросу без перезапуска
+def install_profile_signal():
+    if not hasattr(signal, "SIGUSR1"):
+        return
+    loop = asyncio.get_running_loop()
+
+    def on_signal():
+        if profiler.is_running():
+            print("Reposter: profile already running")
+            return
+        print(f"Reposter: profiling for {PROFILE_SECONDS}s")
+        asyncio.ensure_future(dump_profile(PROFILE_SECONDS))
+
+    loop.add_signal_handler(signal.SIGUSR1, on_signal)
+
+async def _wait_event(event: asyncio.Event, timeout: float):
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def cluster_commands(dp: Dispatcher, bot: Bot):
+    #Кластерный режим: getUpdates по одному токену допускает одного потребителя,
+    #поэтому команды принимает только лидер (cluster.is_leader), рассылку ведут все экземпляры.
+    #Потеряли лидерство — останавливаем приём, его подхватит новый лидер
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    while not stop.is_set():
+        if not cluster.is_leader():
+            await _wait_event(stop, cluster.HEARTBEAT_INTERVAL)
+            continue
+        print("Reposter cluster: leader, polling bot commands")
+        polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False))
+        while cluster.is_leader() and not polling.done() and not stop.is_set():
+            await _wait_event(stop, cluster.HEARTBEAT_INTERVAL)
+        if not polling.done():
+            try:
+                await dp.stop_polling()
+            except RuntimeError:
+                pass
+        try:
+            await polling
+        except Exception as e:
+            print("Reposter cluster: command polling failed:", e)
+        if not stop.is_set():
+            print("Reposter cluster: leadership lost, command polling stopped")
+
+
 async def main():
     BOT_TOKEN = os.getenv("BOT_TOKEN")
     if not BOT_TOKEN:
@@ -345,9 +751,28 @@ async def main():
     STATE_PATH = os.getenv("REPOSTER_STATE_PATH", STATE_PATH_DEFAULT)
     BACKFILL = os.getenv("REPOSTER_BACKFILL", "false").lower() in ("1", "true", "yes")
     AUTO_CHAT = os.getenv("TARGET_CHAT_ID")
+    #кластерный режим: несколько экземпляров делят чаты через Postgres (DATABASE_URL)
+    CLUSTER = os.getenv("REPOSTER_CLUSTER", "false").lower() in ("1", "true", "yes")
+
+    await wait_api_ready(api_url)
+
+    if CLUSTER:
+        await cluster.init(os.getenv("DATABASE_URL", ""))
+        if AUTO_CHAT:
+            try:
+                cid = int(AUTO_CHAT)
+                cursor = 0
+                if not BACKFILL:
+                    async with httpx.AsyncClient(timeout=10.0) as client:
+                        cursor = await fetch_latest_log_id(client, api_url)
+                if await cluster.subscribe(cid, cursor):
+                    print("Auto-subscribed chat id from env:", cid)
+            except Exception:
+                pass
+        cluster.start()
 
     state = load_state(STATE_PATH)
-    if AUTO_CHAT:
+    if AUTO_CHAT and not CLUSTER:
         try:
             cid = int(AUTO_CHAT)
             if cid not in state.get("chats", []):
@@ -363,15 +788,24 @@ async def main():
     )
     dp = Dispatcher()
 
-    register_handlers(dp, STATE_PATH, api_url)
+    register_handlers(dp, STATE_PATH, api_url, cluster_mode=CLUSTER, backfill=BACKFILL)
+    install_profile_signal()
 
-    poll_task = asyncio.create_task(poller(bot, api_url, STATE_PATH, POLL_INTERVAL, BACKFILL))
+    if CLUSTER:
+        poll_task = asyncio.create_task(cluster_poller(bot, api_url, POLL_INTERVAL))
+    else:
+        poll_task = asyncio.create_task(poller(bot, api_url, STATE_PATH, POLL_INTERVAL, BACKFILL))
     print("Reposter: poller task started. Bot polling now...")
 
     try:
-        await dp.start_polling(bot)
+        if CLUSTER:
+            await cluster_commands(dp, bot)
+        else:
+            await dp.start_polling(bot)
     finally:
         poll_task.cancel()
+        if CLUSTER:
+            await cluster.close()
         await bot.session.close()
 
 if __name__ == "__main__":
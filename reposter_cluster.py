@@ -0,0 +1,218 @@
+import os
+import math
+import time
+import uuid
+import socket
+import asyncio
+from datetime import timedelta
+from typing import Dict, Optional
+import asyncpg
+
+#Кластерный режим репостера: общее состояние доставки в Postgres.
+#Каждый подписанный чат принадлежит одному экземпляру по аренде (lease) с продлением по heartbeat.
+#Чаты делятся поровну между живыми экземплярами, чаты упавшего экземпляра забираются
+#после истечения аренды. У каждого чата свой курсор доставки (id последнего отправленного лога).
+#Команды бота (getUpdates) принимает только один экземпляр — лидер по такой же аренде в reposter_leader:
+#Telegram допускает одного потребителя обновлений на токен.
+
+LEASE_TTL = float(os.getenv("REPOSTER_LEASE_TTL", "30"))
+HEARTBEAT_INTERVAL = float(os.getenv("REPOSTER_HEARTBEAT", str(LEASE_TTL / 3)))
+INSTANCE_ID = os.getenv("REPOSTER_INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+_pool: Optional[asyncpg.Pool] = None
+#chat_id -> курсор для чатов, которыми владеет этот экземпляр
+_owned: Dict[int, int] = {}
+#до какого момента (monotonic) наши аренды гарантированно действуют
+_lease_deadline = 0.0
+#до какого момента (monotonic) мы гарантированно лидер; 0 — не лидер
+_leader_deadline = 0.0
+_heartbeat_task: Optional[asyncio.Task] = None
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS reposter_chats (
+        chat_id BIGINT PRIMARY KEY,
+        cursor BIGINT NOT NULL DEFAULT 0,
+        owner TEXT,
+        lease_until TIMESTAMPTZ,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS reposter_chats_owner_idx ON reposter_chats (owner);
+    CREATE TABLE IF NOT EXISTS reposter_instances (
+        instance_id TEXT PRIMARY KEY,
+        heartbeat_at TIMESTAMPTZ NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS reposter_leader (
+        id SMALLINT PRIMARY KEY CHECK (id = 1),
+        owner TEXT NOT NULL,
+        lease_until TIMESTAMPTZ NOT NULL
+    );
+"""
+
+
+async def init(database_url: str):
+    global _pool
+    dsn = database_url.replace("postgresql+asyncpg://", "postgresql://", 1)
+    _pool = await asyncpg.create_pool(dsn, min_size=1, max_size=4)
+    async with _pool.acquire() as conn:
+        await conn.execute(SCHEMA)
+    print("Reposter cluster: instance", INSTANCE_ID)
+
+
+async def close():
+    global _heartbeat_task
+    if _heartbeat_task is not None:
+        _heartbeat_task.cancel()
+        try:
+            await _heartbeat_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        _heartbeat_task = None
+    if _pool is not None:
+        #отпускаем свои чаты, чтобы другие экземпляры забрали их сразу, а не по истечении аренды
+        try:
+            async with _pool.acquire() as conn:
+                await conn.execute(
+                    "UPDATE reposter_chats SET owner = NULL, lease_until = NULL WHERE owner = $1", INSTANCE_ID
+                )
+                await conn.execute("DELETE FROM reposter_instances WHERE instance_id = $1", INSTANCE_ID)
+                await conn.execute("DELETE FROM reposter_leader WHERE owner = $1", INSTANCE_ID)
+        except Exception as e:
+            print("Reposter cluster: release on shutdown failed:", e)
+        await _pool.close()
+
+
+async def subscribe(chat_id: int, cursor: int) -> bool:
+    #Добавляет чат; False, если уже был подписан
+    async with _pool.acquire() as conn:
+        res = await conn.execute(
+            "INSERT INTO reposter_chats (chat_id, cursor) VALUES ($1, $2) ON CONFLICT (chat_id) DO NOTHING",
+            chat_id, cursor
+        )
+    return res.endswith(" 1")
+
+
+async def unsubscribe(chat_id: int) -> bool:
+    async with _pool.acquire() as conn:
+        res = await conn.execute("DELETE FROM reposter_chats WHERE chat_id = $1", chat_id)
+    _owned.pop(chat_id, None)
+    return res.endswith(" 1")
+
+
+async def chat_status(chat_id: int):
+    async with _pool.acquire() as conn:
+        return await conn.fetchrow(
+            "SELECT chat_id, cursor, owner, lease_until FROM reposter_chats WHERE chat_id = $1", chat_id
+        )
+
+
+async def heartbeat():
+    #Продлевает свои аренды, отдаёт лишние чаты и забирает свободные/просроченные до своей доли
+    global _owned, _lease_deadline, _leader_deadline
+    started = time.monotonic()
+    ttl = timedelta(seconds=LEASE_TTL)
+    async with _pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """INSERT INTO reposter_instances (instance_id, heartbeat_at) VALUES ($1, now())
+                   ON CONFLICT (instance_id) DO UPDATE SET heartbeat_at = now()""",
+                INSTANCE_ID
+            )
+            await conn.execute(
+                "DELETE FROM reposter_instances WHERE heartbeat_at < now() - $1::interval", ttl
+            )
+            #лидерство: продлеваем своё или забираем просроченное
+            leader = await conn.fetchval(
+                """INSERT INTO reposter_leader (id, owner, lease_until) VALUES (1, $1, now() + $2::interval)
+                   ON CONFLICT (id) DO UPDATE SET owner = $1, lease_until = now() + $2::interval
+                   WHERE reposter_leader.owner = $1 OR reposter_leader.lease_until < now()
+                   RETURNING owner""",
+                INSTANCE_ID, ttl
+            )
+            live = await conn.fetchval("SELECT count(*) FROM reposter_instances")
+            total = await conn.fetchval("SELECT count(*) FROM reposter_chats")
+            share = math.ceil(total / max(1, live))
+
+            rows = await conn.fetch(
+                """UPDATE reposter_chats SET lease_until = now() + $2::interval
+                   WHERE owner = $1 RETURNING chat_id, cursor""",
+                INSTANCE_ID, ttl
+            )
+            owned = {r["chat_id"]: r["cursor"] for r in rows}
+
+            if len(owned) > share:
+                #перебор — отдаём лишние, их подхватит недогруженный экземпляр
+                extra = sorted(owned)[share:]
+                await conn.execute(
+                    "UPDATE reposter_chats SET owner = NULL, lease_until = NULL WHERE owner = $1 AND chat_id = ANY($2::bigint[])",
+                    INSTANCE_ID, extra
+                )
+                for cid in extra:
+                    owned.pop(cid, None)
+            elif len(owned) < share:
+                rows = await conn.fetch(
+                    """UPDATE reposter_chats SET owner = $1, lease_until = now() + $2::interval
+                       WHERE chat_id IN (
+                           SELECT chat_id FROM reposter_chats
+                           WHERE owner IS NULL OR lease_until < now()
+                           ORDER BY chat_id
+                           LIMIT $3
+                           FOR UPDATE SKIP LOCKED
+                       )
+                       RETURNING chat_id, cursor""",
+                    INSTANCE_ID, ttl, share - len(owned)
+                )
+                for r in rows:
+                    owned[r["chat_id"]] = r["cursor"]
+    #пока шёл heartbeat, доставка могла сдвинуть курсоры — берём наибольший
+    for cid, cur in owned.items():
+        owned[cid] = max(cur, _owned.get(cid, 0))
+    _owned = owned
+    #запас в один интервал heartbeat на сетевые задержки
+    _lease_deadline = started + LEASE_TTL - HEARTBEAT_INTERVAL
+    _leader_deadline = _lease_deadline if leader == INSTANCE_ID else 0.0
+
+
+async def _heartbeat_loop():
+    while True:
+        try:
+            await heartbeat()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("Reposter cluster: heartbeat failed:", e)
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+def start():
+    global _heartbeat_task
+    if _heartbeat_task is None or _heartbeat_task.done():
+        _heartbeat_task = asyncio.create_task(_heartbeat_loop())
+
+
+def owned_chats() -> Dict[int, int]:
+    #Чаты этого экземпляра с курсорами; пусто, если аренда могла истечь (heartbeat не проходит)
+    if time.monotonic() > _lease_deadline:
+        return {}
+    return dict(_owned)
+
+
+def is_leader() -> bool:
+    #Лидер принимает команды бота; False и при потере лидерства, и если heartbeat не проходит
+    return time.monotonic() < _leader_deadline
+
+
+async def advance(chat_id: int, log_id: int) -> bool:
+    #Сдвигает курсор чата. Условие owner = себя — защита от записи после потери аренды.
+    async with _pool.acquire() as conn:
+        res = await conn.execute(
+            "UPDATE reposter_chats SET cursor = $3 WHERE chat_id = $1 AND owner = $2 AND cursor < $3",
+            chat_id, INSTANCE_ID, log_id
+        )
+    if res.endswith(" 1"):
+        _owned[chat_id] = log_id
+        return True
+    if chat_id in _owned and _owned[chat_id] < log_id:
+        #чат у нас отобрали (или удалили) — дальше в него не шлём
+        _owned.pop(chat_id, None)
+        return False
+    return True
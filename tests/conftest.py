@@ -0,0 +1,12 @@
+import os
+import sys
+
+#тесты запускаются из корня репозитория: пакет app и модули верхнего уровня
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+#app.db создаёт engine при импорте. Тесты с БД (TEST_DATABASE_URL) ходят только в тестовую базу,
+#остальным хватает адреса-заглушки: соединения они не открывают
+if os.getenv("TEST_DATABASE_URL"):
+    os.environ["DATABASE_URL"] = os.environ["TEST_DATABASE_URL"]
+else:
+    os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://u:p@127.0.0.1/test")
@@ -0,0 +1,95 @@
+import os
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+
+pytest.importorskip("asyncpg")
+
+from app import backtest, fastpath  # noqa: E402
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+TG = -7_000_000_000_000
+
+
+def test_run_chunk_counts_hits_and_samples():
+    res = backtest._run_chunk(r"\bпрода\w*\b", backtest.trigger_flags(0), ["Продам гараж, продаю", "купить", "ПРОДАЖА"])
+    assert res["messages"] == 3
+    assert res["hit_messages"] == 2
+    assert res["matches"] == 3
+    assert [s["matched_text"] for s in res["samples"]] == ["Продам", "ПРОДАЖА"]
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set")
+def test_iter_backtest_texts_window_and_dedup(monkeypatch):
+    monkeypatch.setattr(fastpath, "DATABASE_URL", TEST_DATABASE_URL)
+    monkeypatch.setattr(fastpath, "_pool", None)
+
+    async def body():
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from app import models
+        engine = create_async_engine(TEST_DATABASE_URL)
+        async with engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+        await engine.dispose()
+        pool = await fastpath.init_pool()
+        now = datetime.now(timezone.utc)
+        try:
+            async with pool.acquire() as conn:
+                await conn.execute("DELETE FROM targets WHERE tg_id = $1", TG)
+                target_id = await conn.fetchval("INSERT INTO targets (tg_id) VALUES ($1) RETURNING id", TG)
+                rows = [
+                    (target_id, 1, "old", now - timedelta(days=10)),
+                    (target_id, 2, "fresh", now - timedelta(days=1)),
+                    (target_id, 2, "fresh", now - timedelta(days=1)),  # то же сообщение, второй триггер
+                    (target_id, None, "no id", now),
+                    (target_id, 3, "newest", now),
+                ]
+                await conn.executemany(
+                    "INSERT INTO logs (target_id, message_id, text, created_at) VALUES ($1, $2, $3, $4)", rows
+                )
+            texts = [r["text"] async for r in fastpath.iter_backtest_texts(days=5)]
+            everything = [r["text"] async for r in fastpath.iter_backtest_texts(days=None)]
+        finally:
+            async with pool.acquire() as conn:
+                await conn.execute("DELETE FROM targets WHERE tg_id = $1", TG)
+            await fastpath.close_pool()
+        return texts, everything
+
+    texts, everything = asyncio.run(body())
+    #в тестовой базе могут быть и чужие логи — сравниваем только свои
+    ours = {"old", "fresh", "no id", "newest"}
+    assert [t for t in texts if t in ours] == ["newest", "no id", "fresh"]
+    assert [t for t in everything if t in ours] == ["newest", "no id", "fresh", "old"]
+
+
+def _corpus(monkeypatch, tmp_path, lines):
+    (tmp_path / "c.txt").write_text("\n".join(lines) + "\n", encoding="utf-8")
+    monkeypatch.setattr(backtest, "BACKTEST_CORPUS_DIR", str(tmp_path))
+    monkeypatch.setattr(backtest, "BACKTEST_WORKERS", 2)
+    monkeypatch.setattr(backtest, "BACKTEST_CHUNK", 2)
+
+
+def test_run_corpus_in_spawned_pool(monkeypatch, tmp_path):
+    _corpus(monkeypatch, tmp_path, ["продам", "куплю", "продаю дом", "нет", "продажа"])
+
+    async def body():
+        try:
+            return await backtest.run(r"\bпрода\w*\b", source="corpus", corpus="c.txt", days=None)
+        finally:
+            backtest.shutdown()
+
+    res = asyncio.run(body())
+    assert (res["messages"], res["hit_messages"]) == (5, 3)
+
+
+def test_run_times_out_on_pathological_pattern(monkeypatch, tmp_path):
+    #катастрофический возврат: пачка не закончится, пул убивается, ошибка — сразу
+    _corpus(monkeypatch, tmp_path, ["a" * 40 + "!"] * 2)
+    monkeypatch.setattr(backtest, "BACKTEST_CHUNK_TIMEOUT", 2.0)
+
+    async def body():
+        with pytest.raises(backtest.ChunkTimeout):
+            await backtest.run(r"^(a+)+$", source="corpus", corpus="c.txt", days=None)
+        assert backtest._executor is None
+
+    asyncio.run(asyncio.wait_for(body(), 30))
@@ -0,0 +1,87 @@
+import json
+import asyncio
+import pytest
+
+pytest.importorskip("aiogram")
+pytest.importorskip("httpx")
+pytest.importorskip("asyncpg")
+
+import reposter_bot  # noqa: E402
+from app import embedded, fastpath  # noqa: E402
+
+
+class FakeDispatcher:
+    async def stop_polling(self):
+        raise RuntimeError("polling not started")
+
+
+class FakeSession:
+    async def close(self):
+        pass
+
+
+class FakeBot:
+    session = FakeSession()
+
+
+def _item(message_id):
+    target = {"tg_id": 100, "username": "chat", "title": "Chat", "type": "Channel"}
+    log = {"message_id": message_id, "author_id": 1, "author_name": "a", "text": "t", "duplicate": False}
+    matches = [{"trigger_id": 1, "trigger_target_id": None, "matched_text": "t"}]
+    return target, log, matches
+
+
+async def _run(monkeypatch, tmp_path, send_delay, messages=3):
+    state_path = tmp_path / "state.json"
+    state_path.write_text(json.dumps({"last_seen_id": 5, "chats": [1], "cursors": {"2": 5}}))
+    sent = []
+
+    async def fake_send(bot, chat, msg):
+        await asyncio.sleep(send_delay)
+        sent.append(chat)
+        return True
+
+    async def no_filters(chat):
+        return None
+
+    async def first_log_id(pairs):
+        #лог с message_id=n имеет id 10 + n
+        return 10 + min(p[1] for p in pairs)
+
+    async def latest_log_id():
+        return 10 + messages
+
+    monkeypatch.setattr(reposter_bot, "send_to_chat", fake_send)
+    monkeypatch.setattr(fastpath, "get_subscription_filters", no_filters)
+    monkeypatch.setattr(fastpath, "known_target_id", lambda tgid: 7)
+    monkeypatch.setattr(fastpath, "first_log_id", first_log_id)
+    monkeypatch.setattr(fastpath, "latest_log_id", latest_log_id)
+    monkeypatch.setattr(embedded, "_state_path", str(state_path))
+    monkeypatch.setattr(embedded, "_bot", FakeBot())
+    monkeypatch.setattr(embedded, "_dp", FakeDispatcher())
+    monkeypatch.setattr(embedded, "_queue", asyncio.Queue())
+    monkeypatch.setattr(embedded, "_tasks", [asyncio.create_task(embedded._deliver())])
+    monkeypatch.setattr(embedded, "EMBEDDED_DRAIN_TIMEOUT", 0.5)
+
+    done = asyncio.get_running_loop().create_future()
+    done.set_result(7)
+    for n in range(1, messages + 1):
+        await embedded.publish(*_item(n), done)
+    await embedded.stop()
+    return sent, json.loads(state_path.read_text())
+
+
+def test_stop_drains_queue_before_moving_cursor(monkeypatch, tmp_path):
+    sent, state = asyncio.run(_run(monkeypatch, tmp_path, send_delay=0))
+    assert len(sent) == 3
+    assert state["last_seen_id"] == 13
+    assert state["cursors"] == {"2": 13}
+
+
+def test_stop_keeps_undelivered_for_standalone_reposter(monkeypatch, tmp_path):
+    #первое сообщение уходит за 0.3 с, второе не успевает до таймаута
+    sent, state = asyncio.run(_run(monkeypatch, tmp_path, send_delay=0.3))
+    assert len(sent) == 1
+    #курсор — до лога перед первым недоставленным (message_id=2 -> id 12)
+    assert state["last_seen_id"] == 11
+    assert state["cursors"] == {"2": 11}
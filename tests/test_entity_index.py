@@ -0,0 +1,26 @@
+import pytest
+
+pytest.importorskip("telethon")
+
+from telethon import utils  # noqa: E402
+from app import entity_index  # noqa: E402
+
+
+def test_warm_restores_username_index(monkeypatch):
+    monkeypatch.setattr(entity_index, "_dialogs", [])
+    monkeypatch.setattr(entity_index, "_by_username", {})
+    monkeypatch.setattr(entity_index, "_by_id", {})
+    entity_index.warm([
+        {"kind": "Channel", "id": 10, "access_hash": 111, "username": "News", "title": "News", "title_lc": "news"},
+        {"kind": "User", "id": 20, "access_hash": 222, "username": "bobby", "title": "Bob", "title_lc": "bob"},
+        {"kind": "Chat", "id": 30, "access_hash": None, "username": None, "title": "Group", "title_lc": "group"},
+        #запись старого формата без access_hash — только для поиска по названию
+        {"kind": "Channel", "id": 40, "username": "oldnews", "title": "Old", "title_lc": "old"},
+    ])
+    ent = entity_index.resolve("https://t.me/news")
+    assert (ent.__class__.__name__, ent.id, ent.username, ent.title) == ("Channel", 10, "News", "News")
+    #сущности хватает для запросов без резолва username в Telegram
+    assert utils.get_input_channel(ent).access_hash == 111
+    assert entity_index.resolve("@bobby").access_hash == 222
+    assert entity_index.resolve("oldnews") is None
+    assert [d["id"] for d in entity_index.search_local("o")] == [30, 40]
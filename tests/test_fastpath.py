@@ -0,0 +1,118 @@
+import os
+import asyncio
+import pytest
+
+pytest.importorskip("asyncpg")
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set")
+
+#tg_id тестовых таргетов — вне диапазона реальных чатов
+TG = -8_000_000_000_000
+
+
+@pytest.fixture
+def fastpath(monkeypatch):
+    from app import fastpath
+    monkeypatch.setattr(fastpath, "DATABASE_URL", TEST_DATABASE_URL)
+    monkeypatch.setattr(fastpath, "_pool", None)
+    monkeypatch.setattr(fastpath, "_target_cache", {})
+    return fastpath
+
+
+async def _with_db(fastpath, body):
+    #Схема, чистые тестовые строки, тело теста; пул живёт в event loop теста
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from app import models
+    engine = create_async_engine(TEST_DATABASE_URL)
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    await engine.dispose()
+    pool = await fastpath.init_pool()
+    cleanup = [
+        "DELETE FROM targets WHERE tg_id <= $1 AND tg_id > $1 - 1000",
+        "DELETE FROM triggers WHERE name = 'test-fastpath'",
+    ]
+    try:
+        async with pool.acquire() as conn:
+            for sql in cleanup:
+                await conn.execute(sql, *([TG] if "$1" in sql else []))
+        await body(pool)
+    finally:
+        async with pool.acquire() as conn:
+            for sql in cleanup:
+                await conn.execute(sql, *([TG] if "$1" in sql else []))
+        await fastpath.close_pool()
+
+
+def test_verify_target_cache_drops_stale_ids(fastpath):
+    async def body(pool):
+        async with pool.acquire() as conn:
+            real = await conn.fetchval("INSERT INTO targets (tg_id, title) VALUES ($1, 'a') RETURNING id", TG)
+        fastpath.warm_targets([
+            [TG, real, None, "a", None],           # совпадает с БД
+            [TG - 1, real, None, "b", None],       # таргета нет в БД
+            [TG - 2, real + 100000, None, "c", None],
+        ])
+        assert await fastpath.verify_target_cache() == 2
+        assert fastpath.known_target_id(TG) == real
+        assert fastpath.known_target_id(TG - 1) is None
+        assert fastpath.known_target_id(TG - 2) is None
+
+    asyncio.run(_with_db(fastpath, body))
+
+
+def test_save_message_forgets_target_on_failure(fastpath):
+    async def body(pool):
+        async with pool.acquire() as conn:
+            trigger_id = await conn.fetchval(
+                "INSERT INTO triggers (name, pattern, flags, enabled) VALUES ('test-fastpath', 'x', 0, FALSE) RETURNING id"
+            )
+        target = {"tg_id": TG - 3, "username": None, "title": "t", "type": "Channel"}
+        #id из "чужой" базы: нарушение внешнего ключа
+        fastpath.warm_targets([[TG - 3, 2_000_000_000, None, "t", "Channel"]])
+        log = {"message_id": 1, "author_id": 1, "author_name": "a", "text": "x", "raw_json": None}
+        matches = [{"trigger_id": trigger_id, "trigger_target_id": None, "matched_text": "x"}]
+        with pytest.raises(Exception):
+            await fastpath.save_message(target, log, matches)
+        assert fastpath.known_target_id(TG - 3) is None
+        #повтор делает upsert и пишет лог с настоящим id
+        target_id = await fastpath.save_message(target, log, matches)
+        async with pool.acquire() as conn:
+            real = await conn.fetchval("SELECT id FROM targets WHERE tg_id = $1", TG - 3)
+            logged = await conn.fetchval("SELECT target_id FROM logs WHERE matched_trigger_id = $1", trigger_id)
+        assert target_id == real == logged
+
+    asyncio.run(_with_db(fastpath, body))
+
+
+def test_rebuild_stats_waits_for_concurrent_bump(fastpath):
+    #запись счётчиков, начатая до пересчёта, не ломает его и не теряется
+    async def body(pool):
+        async with pool.acquire() as conn:
+            trigger_id = await conn.fetchval(
+                "INSERT INTO triggers (name, pattern, flags, enabled) VALUES ('test-fastpath', 'x', 0, FALSE) RETURNING id"
+            )
+            target_id = await conn.fetchval("INSERT INTO targets (tg_id, title) VALUES ($1, 't') RETURNING id", TG - 4)
+            #лог до появления роллапов: в счётчиках его ещё нет
+            await conn.executemany(fastpath.SQL_INSERT_LOG, [(target_id, 1, 1, "a", "x", trigger_id, "x", None, None, False)])
+        row = (target_id, 2, 1, "a", "x", trigger_id, "x", None, None, False)
+        async with pool.acquire() as writer:
+            tx = writer.transaction()
+            await tx.start()
+            await writer.executemany(fastpath.SQL_INSERT_LOG, [row])
+            await fastpath._bump_stats(writer, [row])
+            rebuild = asyncio.create_task(fastpath.rebuild_stats())
+            await asyncio.sleep(0.3)
+            assert not rebuild.done()
+            await tx.commit()
+        await asyncio.wait_for(rebuild, 10)
+        async with pool.acquire() as conn:
+            hits = await conn.fetchval(
+                "SELECT sum(hits) FROM trigger_stats_daily WHERE trigger_id = $1", trigger_id
+            )
+            for table, _ in fastpath.STAT_PERIODS.values():
+                await conn.execute(f"DELETE FROM {table} WHERE trigger_id = $1", trigger_id)
+        assert hits == 2
+
+    asyncio.run(_with_db(fastpath, body))
@@ -0,0 +1,241 @@
+import json
+import asyncio
+import importlib
+from types import SimpleNamespace
+
+import pytest
+
+from app import ingest as ingest_module
+
+
+@pytest.fixture
+def ingest(monkeypatch, tmp_path):
+    #чистое состояние модуля (очередь, статистика) на каждый тест
+    mod = importlib.reload(ingest_module)
+    monkeypatch.setattr(mod, "INGEST_QUEUE_SIZE", 2)
+    monkeypatch.setattr(mod, "INGEST_WORKERS", 1)
+    monkeypatch.setattr(mod, "INGEST_SPILL_PATH", str(tmp_path / "spill.jsonl"))
+    monkeypatch.setattr(mod, "SPILL_POLL_INTERVAL", 0.05)
+    return mod
+
+
+def _event(n, text="u"):
+    return SimpleNamespace(chat_id=1, message=SimpleNamespace(id=n), raw_text=text)
+
+
+class Handler:
+    #Держит единственного воркера на первом сообщении, пока не отпустят
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.seen = []
+
+    async def __call__(self, event):
+        await self.release.wait()
+        self.seen.append(event.message.id)
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def _until(cond, timeout=5):
+    async def wait():
+        while not cond():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(wait(), timeout)
+
+
+def test_block_waits_for_free_slot(ingest, monkeypatch):
+    monkeypatch.setattr(ingest, "INGEST_OVERFLOW", "block")
+
+    async def run():
+        handler = Handler()
+        ingest.start(handler)
+        await ingest.put(_event(1))
+        await _settle()  #воркер взял 1 и ждёт
+        await ingest.put(_event(2))
+        await ingest.put(_event(3))
+        blocked = asyncio.create_task(ingest.put(_event(4)))
+        await _settle()
+        assert not blocked.done()
+        assert ingest.stats()["depth"] == 2
+        handler.release.set()
+        await asyncio.wait_for(blocked, 5)
+        await _until(lambda: len(handler.seen) == 4)
+        await ingest.stop()
+        return handler.seen
+
+    assert asyncio.run(run()) == [1, 2, 3, 4]
+    assert ingest.stats()["dropped"] == 0
+
+
+def test_drop_oldest_keeps_matched(ingest, monkeypatch):
+    monkeypatch.setattr(ingest, "INGEST_OVERFLOW", "drop_oldest")
+
+    async def run():
+        handler = Handler()
+        ingest.start(handler, matcher=lambda e: e.raw_text == "m")
+        await ingest.put(_event(1))
+        await _settle()
+        await ingest.put(_event(2, "u"))
+        await ingest.put(_event(3, "m"))
+        #место под совпавшее освобождает самое старое несовпавшее
+        await ingest.put(_event(4, "m"))
+        assert [it[0].message.id for it in ingest._items] == [3, 4]
+        #несовпавших в очереди нет — выкидывается само входящее несовпавшее
+        await ingest.put(_event(5, "u"))
+        assert [it[0].message.id for it in ingest._items] == [3, 4]
+        #совпавшее не выкидывается — ждём места
+        blocked = asyncio.create_task(ingest.put(_event(6, "m")))
+        await _settle()
+        assert not blocked.done()
+        handler.release.set()
+        await asyncio.wait_for(blocked, 5)
+        await _until(lambda: len(handler.seen) == 4)
+        await ingest.stop()
+        return handler.seen
+
+    assert asyncio.run(run()) == [1, 3, 4, 6]
+    assert ingest.stats()["dropped"] == 2
+
+
+def test_drop_oldest_unknown_match_is_not_cached(ingest, monkeypatch):
+    #до загрузки триггеров матчер отвечает None: такие сообщения не выкидываются,
+    #а после загрузки проверяются заново
+    monkeypatch.setattr(ingest, "INGEST_OVERFLOW", "drop_oldest")
+    triggers = {"loaded": False}
+
+    def matcher(event):
+        if not triggers["loaded"]:
+            return None
+        return event.raw_text == "m"
+
+    async def run():
+        handler = Handler()
+        ingest.start(handler, matcher=matcher)
+        await ingest.put(_event(1))
+        await _settle()
+        await ingest.put(_event(2, "m"))
+        await ingest.put(_event(3, "u"))
+        blocked = asyncio.create_task(ingest.put(_event(4, "m")))
+        await _settle()
+        assert not blocked.done()
+        assert ingest.stats()["dropped"] == 0
+        blocked.cancel()
+        triggers["loaded"] = True
+        await asyncio.wait_for(ingest.put(_event(5, "m")), 1)
+        assert [it[0].message.id for it in ingest._items] == [2, 5]
+        handler.release.set()
+        await _until(lambda: len(handler.seen) == 3)
+        await ingest.stop()
+        return handler.seen
+
+    assert asyncio.run(run()) == [1, 2, 5]
+    assert ingest.stats()["dropped"] == 1
+
+
+def test_spill_writes_and_drains(ingest, monkeypatch):
+    monkeypatch.setattr(ingest, "INGEST_OVERFLOW", "spill")
+    loaded = []
+
+    async def loader(recs):
+        loaded.extend(recs)
+        return [_event(rec["message_id"]) for rec in recs]
+
+    async def run():
+        handler = Handler()
+        ingest.start(handler, loader=loader)
+        await ingest.put(_event(1))
+        await _settle()
+        for n in (2, 3, 4, 5):
+            await ingest.put(_event(n))
+        #в памяти 2 и 3, 4 и 5 — на диске
+        with open(ingest.INGEST_SPILL_PATH, encoding="utf-8") as f:
+            spilled = [json.loads(line) for line in f]
+        assert spilled == [{"chat_id": 1, "message_id": 4}, {"chat_id": 1, "message_id": 5}]
+        assert ingest.stats()["spill_pending"] == 2
+        handler.release.set()
+        await _until(lambda: len(handler.seen) == 5)
+        await ingest.stop()
+        return handler.seen
+
+    assert asyncio.run(run()) == [1, 2, 3, 4, 5]
+    assert [r["message_id"] for r in loaded] == [4, 5]
+    stats = ingest.stats()
+    assert stats["spilled"] == 2 and stats["unspilled"] == 2 and stats["spill_pending"] == 0
+
+
+def test_spill_retries_failed_load(ingest, monkeypatch):
+    #упавшая загрузка не теряет пачку: курсор не сдвигается, пачка повторяется целиком
+    monkeypatch.setattr(ingest, "INGEST_OVERFLOW", "spill")
+    monkeypatch.setattr(ingest, "INGEST_QUEUE_SIZE", 4)
+    calls = []
+
+    async def loader(recs):
+        calls.append([r["message_id"] for r in recs])
+        if len(calls) == 1:
+            raise ConnectionError("client not connected")
+        #сообщение 7 удалено из чата
+        return [_event(r["message_id"]) if r["message_id"] != 7 else None for r in recs]
+
+    async def run():
+        handler = Handler()
+        ready = asyncio.Event()
+        ingest.start(handler, loader=loader, ready=ready)
+        await ingest.put(_event(1))
+        await _settle()
+        for n in range(2, 9):
+            await ingest.put(_event(n))
+        assert ingest.stats()["spill_pending"] == 3
+        handler.release.set()
+        await _until(lambda: len(handler.seen) == 5)
+        await asyncio.sleep(0.2)
+        #до готовности клиента выгруженное не трогаем
+        assert calls == []
+        ready.set()
+        await _until(lambda: len(handler.seen) == 7)
+        await ingest.stop()
+        return handler.seen
+
+    assert asyncio.run(run()) == [1, 2, 3, 4, 5, 6, 8]
+    assert calls == [[6], [6], [7], [8]]
+    assert ingest.stats()["spill_pending"] == 0
+    assert open(ingest.INGEST_SPILL_PATH).read() == ""
+
+
+def test_stop_drains_queue(ingest, monkeypatch):
+    monkeypatch.setattr(ingest, "INGEST_OVERFLOW", "block")
+
+    async def run():
+        handler = Handler()
+        ingest.start(handler)
+        for n in (1, 2, 3):
+            await ingest.put(_event(n))
+        await _settle()
+        asyncio.get_running_loop().call_later(0.1, handler.release.set)
+        await ingest.stop()
+        return handler.seen
+
+    assert asyncio.run(run()) == [1, 2, 3]
+
+
+def test_stop_spills_leftovers(ingest, monkeypatch):
+    #воркер не успел за INGEST_DRAIN_TIMEOUT: текущее и очередь — в файл, а не в никуда
+    monkeypatch.setattr(ingest, "INGEST_OVERFLOW", "spill")
+    monkeypatch.setattr(ingest, "INGEST_DRAIN_TIMEOUT", 0.1)
+    monkeypatch.setattr(ingest, "INGEST_QUEUE_SIZE", 4)
+
+    async def run():
+        handler = Handler()
+        ingest.start(handler)
+        for n in (1, 2, 3):
+            await ingest.put(_event(n))
+        await _settle()
+        await ingest.stop()
+        return handler.seen
+
+    assert asyncio.run(run()) == []
+    with open(ingest.INGEST_SPILL_PATH, encoding="utf-8") as f:
+        assert [json.loads(line)["message_id"] for line in f] == [1, 2, 3]
+    assert ingest.stats()["depth"] == 0 and ingest.stats()["spill_pending"] == 3
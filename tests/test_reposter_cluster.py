@@ -0,0 +1,49 @@
+import os
+import asyncio
+import pytest
+
+pytest.importorskip("asyncpg")
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set")
+
+import reposter_cluster as cluster  # noqa: E402
+
+
+async def _clean():
+    async with cluster._pool.acquire() as conn:
+        await conn.execute("DELETE FROM reposter_leader WHERE owner LIKE 'test-%'")
+        await conn.execute("DELETE FROM reposter_instances WHERE instance_id LIKE 'test-%'")
+
+
+def test_single_leader_takes_over_after_release(monkeypatch):
+    #команды бота принимает один экземпляр; ушедший лидер отдаёт аренду сразу
+    monkeypatch.setattr(cluster, "_owned", {})
+
+    async def as_instance(instance_id):
+        monkeypatch.setattr(cluster, "INSTANCE_ID", instance_id)
+        await cluster.heartbeat()
+        return cluster.is_leader()
+
+    async def run():
+        await cluster.init(TEST_DATABASE_URL)
+        try:
+            await _clean()
+            async with cluster._pool.acquire() as conn:
+                assert await conn.fetchval("SELECT count(*) FROM reposter_leader") == 0
+            first = await as_instance("test-a")
+            second = await as_instance("test-b")
+            renewed = await as_instance("test-a")
+            monkeypatch.setattr(cluster, "INSTANCE_ID", "test-a")
+        finally:
+            #close() отпускает аренды test-a
+            await cluster.close()
+        await cluster.init(TEST_DATABASE_URL)
+        try:
+            taken = await as_instance("test-b")
+            await _clean()
+        finally:
+            await cluster._pool.close()
+        return first, second, renewed, taken
+
+    assert asyncio.run(run()) == (True, False, True, True)
@@ -0,0 +1,105 @@
+import re
+import asyncio
+import importlib
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip("telethon")
+pytest.importorskip("asyncpg")
+pytest.importorskip("dotenv")
+
+
+@pytest.fixture
+def tele_client(monkeypatch, tmp_path):
+    #модуль читает настройки при импорте
+    monkeypatch.setenv("TG_API_ID", "1")
+    monkeypatch.setenv("TG_API_HASH", "hash")
+    monkeypatch.setenv("TG_SESSION", str(tmp_path / "test_session"))
+    monkeypatch.setenv("BOT_AUTHOR_ID", "1")
+    monkeypatch.setenv("BOT_AUTHOR_NAME", "bot")
+    return importlib.import_module("app.tele_client")
+
+
+class FakeEvent:
+    def __init__(self, text):
+        self.raw_text = text
+        self.message = SimpleNamespace(id=7)
+
+    async def get_sender(self):
+        return SimpleNamespace(id=42, username="author")
+
+
+def _run(tele_client, monkeypatch, text, stages):
+    saved = []
+
+    async def fake_save(target, log, matches):
+        saved.append((target, log, matches))
+        return 1
+
+    monkeypatch.setattr(tele_client.fastpath, "save_message", fake_save)
+    monkeypatch.setattr(tele_client, "_compiled_triggers", [
+        {"id": 1, "target_id": None, "regex": re.compile(r"\bпрода\w*\b", re.IGNORECASE)}
+    ])
+    #новая версия триггеров — текст гарантированно не из кэша совпадений
+    tele_client.versions.bump("triggers")
+    chat = SimpleNamespace(id=100, title="Chat", username="chat")
+    asyncio.run(tele_client._process_message(chat, FakeEvent(text), stages))
+    return saved
+
+
+def test_process_message_records_stages(tele_client, monkeypatch):
+    monkeypatch.setattr(tele_client.profiler, "SLOW_MESSAGE_MS", 1.0)
+    stages = {}
+    saved = _run(tele_client, monkeypatch, "Продам гараж", stages)
+    assert len(saved) == 1
+    assert [m["matched_text"] for m in saved[0][2]] == ["Продам"]
+    assert {"get_sender", "match", "save"} <= set(stages)
+    assert all(isinstance(v, float) for v in stages.values())
+
+
+def test_process_message_without_stages(tele_client, monkeypatch):
+    saved = _run(tele_client, monkeypatch, "продаю велосипед", None)
+    assert len(saved) == 1
+    assert saved[0][1]["message_id"] == 7
+
+
+def test_search_fallback_is_not_cached(tele_client, monkeypatch):
+    calls = []
+
+    async def failing_client(request):
+        calls.append(request)
+        raise ConnectionError("network down")
+
+    async def ok_client(request):
+        calls.append(request)
+        return SimpleNamespace(chats=[SimpleNamespace(id=5, username="news", title="News")])
+
+    monkeypatch.setattr(tele_client, "client", failing_client)
+    monkeypatch.setattr(tele_client.entity_index, "search_local", lambda q, limit: [{"id": 1, "title": "local"}])
+    assert asyncio.run(tele_client.search_public("news-test-fallback")) == [{"id": 1, "title": "local"}]
+
+    #после сбоя запрос снова идёт в Telegram, успешный ответ кэшируется
+    monkeypatch.setattr(tele_client, "client", ok_client)
+    first = asyncio.run(tele_client.search_public("news-test-fallback"))
+    second = asyncio.run(tele_client.search_public("news-test-fallback"))
+    assert first == second and first[0]["username"] == "news"
+    assert len(calls) == 2
+
+
+def test_load_spilled_one_request_per_chat(tele_client, monkeypatch):
+    requests = []
+
+    async def fake_get_messages(chat_id, ids):
+        requests.append((chat_id, list(ids)))
+        return [SimpleNamespace(chat_id=chat_id, id=i) if i != 3 else None for i in ids]
+
+    monkeypatch.setattr(tele_client.client, "get_messages", fake_get_messages)
+    recs = [
+        {"chat_id": 10, "message_id": 1},
+        {"chat_id": 20, "message_id": 2},
+        {"chat_id": 10, "message_id": 3},
+        {"chat_id": None, "message_id": 4},
+    ]
+    msgs = asyncio.run(tele_client._load_spilled(recs))
+    assert requests == [(10, [1, 3]), (20, [2])]
+    assert [(m.chat_id, m.id) if m else None for m in msgs] == [(10, 1), (20, 2), None, None]